@@ -0,0 +1,169 @@
+"""
+Push-down bucketed checksum comparison of a table or view (table_view_diff_checker.py --checksum).
+
+Both engines hash every row server-side and return only a row count and a checksum (the sum of the row
+hashes) per bucket, where the bucket is a prefix of the MD5 of a key column followed by the MD5 of the
+row (only the MD5 of the row without a key). Buckets that differ are split into the 256 buckets of the
+next two hex digits, Merkle-style, until they hold at most `leaf_rows` rows; only then are the rows of
+those buckets fetched and compared.
+
+Digits that all rows of a bucket share are skipped, so a skewed key (e.g. NULL in many rows) goes
+straight to its row hashes. A large bucket whose rows all have the same hash holds copies of one row:
+only the row counts are compared and no row is fetched.
+
+Rows are rendered to text with the same format on both engines, so equal data gives equal checksums.
+Values that still render differently only make more buckets differ: the fetched rows are compared with
+diff_rows() on their values, so such rows are never reported as differences.
+"""
+import os
+
+import pandas as pd
+
+from diff_checker_base import diff_rows, exec_queries
+
+NULL_MARKER = '\\N'
+COLUMN_SEPARATOR = '|'
+# two hex digits (256 buckets) per level; an MD5 has 32
+PREFIX_STEP = 2
+MD5_LENGTH = 32
+
+FLOAT_TYPES = {'REAL', 'FLOAT4', 'DOUBLE PRECISION', 'FLOAT8', 'FLOAT'}
+TIMESTAMP_FORMATS = {'redshift': 'YYYY-MM-DD HH24:MI:SS.US', 'snowflake': 'YYYY-MM-DD HH24:MI:SS.FF6'}
+
+
+def column_expression(column: str, data_type: str, engine: str) -> str:
+    """Text of a column with the same format on Redshift and Snowflake (data_type from information_schema)."""
+    data_type = data_type.upper()
+    if data_type in FLOAT_TYPES:
+        expression = f'CAST(CAST({column} AS DECIMAL(38,6)) AS VARCHAR)'
+    elif data_type.startswith('TIMESTAMP'):
+        expression = f"TO_CHAR({column}, '{TIMESTAMP_FORMATS[engine]}')"
+    elif data_type == 'DATE':
+        expression = f"TO_CHAR({column}, 'YYYY-MM-DD')"
+    elif data_type == 'BOOLEAN':
+        expression = f"CASE WHEN {column} THEN '1' ELSE '0' END"
+    elif data_type in ('CHARACTER', 'CHAR', 'BPCHAR'):
+        expression = f'RTRIM({column})'
+    else:
+        expression = f'CAST({column} AS VARCHAR)'
+    return f"COALESCE({expression}, '{NULL_MARKER}')"
+
+
+def row_expression(columns: list, engine: str) -> str:
+    return f" || '{COLUMN_SEPARATOR}' || ".join(column_expression(column, data_type, engine)
+                                                for column, data_type in columns)
+
+
+def row_hash_number(row: str, engine: str) -> str:
+    """60 bits of the MD5 of the row as a number, summed as DECIMAL(38,0) so the sum does not overflow."""
+    if engine == 'redshift':
+        number = f'STRTOL(SUBSTRING(MD5({row}), 1, 15), 16)'
+    else:
+        number = f"TO_NUMBER(SUBSTRING(MD5({row}), 1, 15), 'XXXXXXXXXXXXXXX')"
+    return f'CAST({number} AS DECIMAL(38,0))'
+
+
+def bucket_condition(table: str, where: str, bucket_hash: str, prefix: str) -> str:
+    conditions = [f'({where})'] if where and where.strip() else []
+    if prefix:
+        conditions.append(f"SUBSTRING({bucket_hash}, 1, {len(prefix)}) = '{prefix}'")
+    return f"FROM {table}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '')
+
+
+def hash_length(key: str) -> int:
+    """Hex digits of the bucket hash: the MD5 of the key and of the row, or of the row only."""
+    return MD5_LENGTH * 2 if key else MD5_LENGTH
+
+
+def bucket_hash_expression(columns: list, key: str, engine: str, length: int) -> str:
+    """Bucket hash used up to `length` digits: the MD5 of the row is only appended past the key digits."""
+    row_hash = f'MD5({row_expression(columns, engine)})'
+    if not key:
+        return row_hash
+    key_hash = f'MD5({column_expression(key, dict(columns).get(key, "VARCHAR"), engine)})'
+    return key_hash if length <= MD5_LENGTH else f'{key_hash} || {row_hash}'
+
+
+def bucket_query(table: str, where: str, columns: list, key: str, engine: str, prefix: str) -> str:
+    """Row count, checksum and lowest and highest full hash of every bucket one level below `prefix`."""
+    length = min(len(prefix) + PREFIX_STEP, hash_length(key))
+    full_hash = bucket_hash_expression(columns, key, engine, hash_length(key))
+    return f"SELECT SUBSTRING({bucket_hash_expression(columns, key, engine, length)}, 1, {length}) AS bucket, " \
+           f"COUNT(*) AS row_count, SUM({row_hash_number(row_expression(columns, engine), engine)}) AS checksum, " \
+           f"MIN({full_hash}) AS first_hash, MAX({full_hash}) AS last_hash " \
+           f"{bucket_condition(table, where, bucket_hash_expression(columns, key, engine, len(prefix)), prefix)} " \
+           f"GROUP BY 1"
+
+
+def rows_query(table: str, where: str, columns: list, key: str, engine: str, prefix: str) -> str:
+    """The rows of one bucket."""
+    column_list = ', '.join(column for column, _ in columns)
+    bucket_hash = bucket_hash_expression(columns, key, engine, len(prefix))
+    return f"SELECT {column_list} {bucket_condition(table, where, bucket_hash, prefix)}"
+
+
+def differing_buckets(df_redshift: pd.DataFrame, df_snowflake: pd.DataFrame) -> pd.DataFrame:
+    """Buckets whose row count or checksum differs, with the row counts of both sides."""
+    buckets = df_redshift.merge(df_snowflake, on='bucket', how='outer', suffixes=('_redshift', '_snowflake'))
+    for column in ('row_count_redshift', 'row_count_snowflake'):
+        buckets[column] = pd.to_numeric(buckets[column]).fillna(0).astype('int64')
+    # checksums stay Decimal/int objects: as float64 they would lose the low bits
+    for column in ('checksum_redshift', 'checksum_snowflake'):
+        buckets[column] = buckets[column].astype('object').where(buckets[column].notna(), 0)
+    return buckets[(buckets['row_count_redshift'] != buckets['row_count_snowflake'])
+                   | (buckets['checksum_redshift'] != buckets['checksum_snowflake'])]
+
+
+def compare_checksums(redshift_conn, snowflake_conn, table: str, where: str, columns: list, key: str = None,
+                      leaf_rows: int = 1000) -> dict:
+    """
+    Locate the rows that differ between Redshift and Snowflake by drilling down into differing buckets.
+
+    `columns` is a list of (column name, Redshift data type). Returns the number of queries, the buckets
+    compared and differing, the time spent on each side, the rows missing and extra in Snowflake, and the
+    first differing rows.
+    """
+    report = {
+        'queries': 0, 'buckets': 0, 'differing_buckets': 0, 'time_redshift': 0.0, 'time_snowflake': 0.0,
+        'rows_missing_in_snowflake': 0, 'rows_extra_in_snowflake': 0, 'missing_rows': [], 'extra_rows': [],
+    }
+
+    def run(make_query, prefix):
+        (df_redshift, time_redshift), (df_snowflake, time_snowflake) = exec_queries(
+            redshift_conn, make_query(table, where, columns, key, 'redshift', prefix),
+            snowflake_conn, make_query(table, where, columns, key, 'snowflake', prefix))
+        report['queries'] += 1
+        report['time_redshift'] += time_redshift
+        report['time_snowflake'] += time_snowflake
+        df_snowflake.columns = df_snowflake.columns.str.lower()
+        return df_redshift, df_snowflake
+
+    prefixes = ['']
+    while prefixes:
+        prefix = prefixes.pop()
+        df_redshift, df_snowflake = run(bucket_query, prefix)
+        report['buckets'] += len(set(df_redshift['bucket']) | set(df_snowflake['bucket']))
+        for bucket in differing_buckets(df_redshift, df_snowflake).itertuples():
+            report['differing_buckets'] += 1
+            rows = max(bucket.row_count_redshift, bucket.row_count_snowflake)
+            if rows > leaf_rows:
+                # skip the digits that all rows of the bucket share
+                hashes = [value for value in (bucket.first_hash_redshift, bucket.last_hash_redshift,
+                                              bucket.first_hash_snowflake, bucket.last_hash_snowflake)
+                          if isinstance(value, str)]
+                shared = os.path.commonprefix([min(hashes), max(hashes)])
+                if len(shared) < hash_length(key):
+                    prefixes.append(shared)
+                    continue
+                # copies of one row: only their number differs
+                report['rows_missing_in_snowflake'] += max(0, bucket.row_count_redshift - bucket.row_count_snowflake)
+                report['rows_extra_in_snowflake'] += max(0, bucket.row_count_snowflake - bucket.row_count_redshift)
+                continue
+            # a small bucket: compare its rows
+            df_redshift_rows, df_snowflake_rows = run(rows_query, bucket.bucket)
+            missing, extra = diff_rows(df_redshift_rows, df_snowflake_rows)
+            report['rows_missing_in_snowflake'] += len(missing)
+            report['rows_extra_in_snowflake'] += len(extra)
+            report['missing_rows'] += missing.head(10 - len(report['missing_rows'])).to_dict('records')
+            report['extra_rows'] += extra.head(10 - len(report['extra_rows'])).to_dict('records')
+    return report
@@ -1,8 +1,13 @@
 import logging
 import os
+import threading
 import time
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from decimal import Decimal
+from functools import partial, wraps
 
+import numpy as np
 import pandas as pd
 import psycopg2
 from snowflake.sqlalchemy import URL
@@ -45,21 +50,323 @@ def add_exec_time(func):
 
 
 @add_exec_time
-def exec_query_redshift(redshift_conn, sql: str) -> pd.DataFrame:
-    df: pd.DataFrame = redshift_conn.exec_query(sql)
-    sort_columns: list = df.columns.tolist()
-    return df.sort_values(sort_columns).reset_index(drop=True)
+def exec_query_redshift(redshift_conn, sql: str, cancel=None) -> pd.DataFrame:
+    return redshift_conn.exec_query(sql, cancel)
 
 
 @add_exec_time
-def exec_query_snowflake(snowflake_conn, sql: str) -> pd.DataFrame:
-    df: pd.DataFrame = snowflake_conn.exec_query(sql)
-    sort_columns: list = df.columns.tolist()
-    return df.sort_values(sort_columns).reset_index(drop=True)
+def exec_query_snowflake(snowflake_conn, sql: str, cancel=None) -> pd.DataFrame:
+    return snowflake_conn.exec_query(sql, cancel)
 
 
-class RedshiftConnector:
+def exec_in_slot(conn, exec_query, sql: str, cancel=None):
+    """Run exec_query_redshift or exec_query_snowflake once the connector has a free slot, so the time
+    spent waiting for the slot is not counted as query time."""
+    with conn.slot():
+        return exec_query(conn, sql, cancel)
+
+
+def exec_queries(redshift_conn, sql_redshift: str, snowflake_conn, sql_snowflake: str):
+    """
+    Run the Redshift and Snowflake queries at the same time.
+
+    Returns ((df_redshift, time_redshift), (df_snowflake, time_snowflake)), each side timed on its own.
+    If one side fails, the query still running on the other side is cancelled and the error is raised.
+    """
+    cancels = {'redshift': QueryCancel(), 'snowflake': QueryCancel()}
+    results = {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            executor.submit(exec_in_slot, redshift_conn, exec_query_redshift, sql_redshift,
+                            cancels['redshift']): 'redshift',
+            executor.submit(exec_in_slot, snowflake_conn, exec_query_snowflake, sql_snowflake,
+                            cancels['snowflake']): 'snowflake',
+        }
+        for future in as_completed(futures):
+            side = futures[future]
+            if future.exception() is not None:
+                cancels['snowflake' if side == 'redshift' else 'redshift'].cancel()
+                raise future.exception()
+            results[side] = future.result()
+    return results['redshift'], results['snowflake']
+
+
+# integers are hashed exactly, other numbers on 40 bits of mantissa (about 12 significant digits)
+HASH_MANTISSA_BITS = 40
+NULL_HASH_VALUE = '\0NULL'
+# int64 half of a number that is not an integer (or NULL)
+NOT_AN_INTEGER = np.iinfo('int64').min
+INT64_BOUND = 2.0 ** 63
+# column hash of NULL in every dtype
+NULL_HASH = pd.util.hash_array(np.array([NULL_HASH_VALUE], dtype=object))[0]
+
+
+def round_mantissa(floats: np.ndarray) -> np.ndarray:
+    mantissa, exponent = np.frexp(floats)
+    scale = float(2 ** HASH_MANTISSA_BITS)
+    # + 0.0 turns -0.0 into 0.0
+    return np.ldexp(np.round(mantissa * scale) / scale, exponent) + 0.0
+
+
+def numeric_values(values: pd.Series):
+    """float64 array of a numeric column (int, float, bool, Decimal objects) with NULL as NaN, or None."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype='float64', na_value=np.nan)
+    if pd.api.types.infer_dtype(values, skipna=True) in ('integer', 'floating', 'mixed-integer-float', 'decimal',
+                                                          'boolean', 'empty'):
+        # Decimal (NUMERIC columns) and other numbers in object columns, or only NULL (None)
+        return pd.to_numeric(values.where(values.notna(), np.nan)).to_numpy(dtype='float64')
+    return None
+
+
+def split_floats(floats: np.ndarray):
+    """
+    (float64, int64) halves of float values: integral floats, also after the mantissa rounding, go exactly
+    to the int64 half (0.0 in the float half), the others rounded to the float half (NOT_AN_INTEGER).
+    """
+    with np.errstate(invalid='ignore'):
+        integral = (floats == np.trunc(floats)) & (np.abs(floats) < INT64_BOUND)
+        rounded = round_mantissa(floats)
+        rounded_integral = ~integral & (rounded == np.trunc(rounded)) & (np.abs(rounded) < INT64_BOUND)
+    integers = np.where(integral, floats, np.where(rounded_integral, rounded, 0.0)).astype('int64')
+    is_integer = integral | rounded_integral
+    return (np.where(is_integer, 0.0, rounded),
+            np.where(is_integer, integers, NOT_AN_INTEGER))
+
+
+def split_numbers(values: pd.Series):
+    """
+    (float64, int64) halves of a numeric column for hashing, or None for other columns.
+
+    Integers (int, bool, integral Decimal and integral float) are kept exactly in the int64 half, so that
+    they hash the same whatever the type an engine returns them as, while other numbers are rounded to
+    HASH_MANTISSA_BITS in the float half. NULL is NaN and NOT_AN_INTEGER.
+    """
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        null = values.isna().to_numpy()
+        integers = values.to_numpy(dtype='int64', na_value=0)
+        return np.where(null, np.nan, 0.0), np.where(null, NOT_AN_INTEGER, integers)
+    if pd.api.types.is_numeric_dtype(values):
+        return split_floats(values.to_numpy(dtype='float64', na_value=np.nan))
+    if numeric_values(values) is None:
+        return None
+    # numbers in object columns: Python int and Decimal may exceed the 53 bits of a float
+    floats = np.full(len(values), np.nan)
+    integers = np.full(len(values), NOT_AN_INTEGER, dtype='int64')
+    for i, value in enumerate(values.to_numpy(dtype=object)):
+        if pd.isna(value):
+            continue
+        integral = isinstance(value, (bool, np.bool_, int, np.integer)) or (
+            isinstance(value, Decimal) and value.is_finite() and value == value.to_integral_value())
+        if integral and -INT64_BOUND < value < INT64_BOUND:
+            integers[i] = int(value)
+        else:
+            floats[i] = float(value)
+    split_halves = split_floats(floats)
+    is_integer = integers != NOT_AN_INTEGER
+    return (np.where(is_integer, 0.0, split_halves[0]),
+            np.where(is_integer, integers, split_halves[1]))
+
+
+def normalize_column(values: pd.Series) -> pd.Series:
+    """
+    Column values in a form that hashes the same on both engines.
+
+    Numbers (int, float, Decimal, bool) become float64 rounded to HASH_MANTISSA_BITS, timestamps become
+    naive UTC, everything else its string, and NULL, None and NaN one marker.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert(None)
+        return values.astype('int64').where(values.notna(), np.nan)
+    floats = numeric_values(values)
+    if floats is not None:
+        return pd.Series(round_mantissa(floats), index=values.index)
+    return values.astype(str).where(values.notna(), NULL_HASH_VALUE)
+
+
+def hash_rows(df: pd.DataFrame, columns: list) -> pd.Series:
+    """
+    One 64 bit hash per row of the normalized `columns` (numeric columns as their two split_numbers halves).
+
+    Each column is hashed on its own first, so that NULL hashes the same whatever the column dtype (an
+    all-None object column and an all-NaN float column match).
+    """
+    column_hashes = {}
+    for i, column in enumerate(columns):
+        values = df[column]
+        numbers = split_numbers(values)
+        normalized = normalize_column(values) if numbers is None else pd.DataFrame(dict(enumerate(numbers)))
+        hashes = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+        hashes[values.isna().to_numpy()] = NULL_HASH
+        column_hashes[i] = hashes
+    return pd.util.hash_pandas_object(pd.DataFrame(column_hashes, index=df.index), index=False)
+
+
+def compare_rows(df_redshift: pd.DataFrame, df_snowflake: pd.DataFrame) -> dict:
+    """
+    Compare two results as multisets of rows, independent of the row order and without sorting.
+
+    Rows are hashed on the columns of the Redshift result. Returns the row counts of both sides and the
+    number of rows missing in Snowflake (only in Redshift) and extra in Snowflake (only in Snowflake).
+    """
+    columns = df_redshift.columns.tolist()
+    counts = pd.concat([
+        hash_rows(df_redshift, columns).value_counts(sort=False),
+        -hash_rows(df_snowflake, columns).value_counts(sort=False),
+    ]).groupby(level=0, sort=False).sum()
+    return {
+        'rows_redshift': len(df_redshift),
+        'rows_snowflake': len(df_snowflake),
+        'missing_in_snowflake': int(counts[counts > 0].sum()),
+        'extra_in_snowflake': int(-counts[counts < 0].sum()),
+    }
+
+
+def diff_rows(df_redshift: pd.DataFrame, df_snowflake: pd.DataFrame):
+    """
+    The rows behind compare_rows(): (rows missing in Snowflake, extra rows in Snowflake).
+
+    A row occurring n times on one side and m < n times on the other is returned n - m times.
+    """
+    columns = df_redshift.columns.tolist()
+    hashes_redshift = hash_rows(df_redshift, columns)
+    hashes_snowflake = hash_rows(df_snowflake, columns)
+
+    def surplus(hashes, other_hashes):
+        occurrence = hashes.groupby(hashes, sort=False).cumcount()
+        other_count = hashes.map(other_hashes.value_counts(sort=False)).fillna(0)
+        return (occurrence >= other_count).to_numpy()
+
+    return (df_redshift[surplus(hashes_redshift, hashes_snowflake)],
+            df_snowflake[columns][surplus(hashes_snowflake, hashes_redshift)])
+
+
+def sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows sorted by every column, to line up the rows of two results that differ."""
+    return df.sort_values(df.columns.tolist()).reset_index(drop=True)
+
+
+def compare_values(df_redshift: pd.DataFrame, df_snowflake: pd.DataFrame, threshold: float) -> dict:
+    """
+    Compare two results cell by cell: rows in the same order (see sort_rows), columns by the Redshift names.
+
+    All numeric columns are compared in one NumPy pass over all rows. The error rate of a cell is
+    |snowflake - redshift| / |redshift| in percent (infinite for a difference from 0) and the cell
+    mismatches above `threshold`. Cells of other columns mismatch when their values differ. NULL or NaN
+    on one side only is a mismatch, on both sides a match, and rows only on one side are mismatches.
+
+    Returns per column the maximum absolute error and error rate (None for non-numeric columns) and the
+    number of mismatching cells, plus the largest error rate, its column and the total of mismatches.
+    """
+    columns = df_redshift.columns.tolist()
+    rows = min(len(df_redshift), len(df_snowflake))
+    mismatches = abs(len(df_redshift) - len(df_snowflake))
+    df_redshift = df_redshift.iloc[:rows].reset_index(drop=True)
+    df_snowflake = df_snowflake[columns].iloc[:rows].reset_index(drop=True)
+
+    column_reports = {}
+    numeric_columns, redshift_values, snowflake_values = [], [], []
+    for column in columns:
+        redshift_floats = numeric_values(df_redshift[column])
+        snowflake_floats = numeric_values(df_snowflake[column])
+        if redshift_floats is not None and snowflake_floats is not None:
+            numeric_columns.append(column)
+            redshift_values.append(redshift_floats)
+            snowflake_values.append(snowflake_floats)
+            continue
+        redshift_text = normalize_column(df_redshift[column])
+        snowflake_text = normalize_column(df_snowflake[column])
+        differs = (redshift_text != snowflake_text) & ~(df_redshift[column].isna() & df_snowflake[column].isna())
+        column_reports[column] = {'max_abs_error': None, 'max_error_rate': None, 'mismatches': int(differs.sum())}
+
+    if numeric_columns and rows:
+        redshift_values = np.column_stack(redshift_values)
+        snowflake_values = np.column_stack(snowflake_values)
+        redshift_null, snowflake_null = np.isnan(redshift_values), np.isnan(snowflake_values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            abs_error = np.abs(snowflake_values - redshift_values)
+            error_rate = np.where(redshift_values != 0, abs_error / np.abs(redshift_values) * 100,
+                                  np.where(abs_error == 0, 0.0, np.inf))
+        any_null = redshift_null | snowflake_null
+        abs_error[any_null] = 0.0
+        error_rate[any_null] = 0.0
+        mismatch = (redshift_null != snowflake_null) | (error_rate > threshold)
+        for i, column in enumerate(numeric_columns):
+            column_reports[column] = {'max_abs_error': float(abs_error[:, i].max()),
+                                      'max_error_rate': float(error_rate[:, i].max()),
+                                      'mismatches': int(mismatch[:, i].sum())}
+    for column in numeric_columns:
+        column_reports.setdefault(column, {'max_abs_error': 0.0, 'max_error_rate': 0.0, 'mismatches': 0})
+
+    column_reports = {column: column_reports[column] for column in columns}
+    max_error_rate, max_error_column = 0.0, ''
+    for column, report in column_reports.items():
+        mismatches += report['mismatches']
+        if report['max_error_rate'] is not None and report['max_error_rate'] > max_error_rate:
+            max_error_rate, max_error_column = report['max_error_rate'], column
+    return {'columns': column_reports, 'max_error_rate': max_error_rate, 'max_error_column': max_error_column,
+            'mismatches': mismatches}
+
+
+def format_value_diff(value_diff: dict) -> str:
+    """The columns with mismatches of compare_values(), one per line."""
+    return '\n'.join(
+        f"{column}: {report['mismatches']} mismatches" +
+        (f", max error {report['max_abs_error']} ({report['max_error_rate']:.12f}%)"
+         if report['max_error_rate'] is not None else '')
+        for column, report in value_diff['columns'].items() if report['mismatches'])
+
+
+class QueryCancelledError(Exception):
+    pass
+
+
+class QueryCancel:
+    """
+    Cancels a query running on another thread.
+
+    The connector registers how to cancel its query when the query starts; a query started after
+    cancel() raises QueryCancelledError instead of running.
+    """
     def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.canceller = None
+
+    def register(self, canceller):
+        with self.lock:
+            if self.cancelled:
+                raise QueryCancelledError('query cancelled')
+            self.canceller = canceller
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            canceller = self.canceller
+        if canceller is not None:
+            try:
+                canceller()
+            except Exception:
+                # the query may have finished in the meantime
+                pass
+
+
+# seconds a pooled connection may be idle before it is checked with a query before use
+HEALTH_CHECK_INTERVAL = 60
+
+
+class RedshiftConnector:
+    """
+    Redshift connections kept open for the life of the process.
+
+    Idle connections are reused by the next query (one per thread running queries at the same time).
+    A connection idle for more than HEALTH_CHECK_INTERVAL seconds is checked with "SELECT 1" first,
+    and a query that fails because its connection was lost is run once more on a new connection.
+    With max_concurrency, at most that many queries run at the same time in slot().
+    Use as a context manager, or call close(), to close the connections.
+    """
+    def __init__(self, max_concurrency=None):
         self.redshift_config = {
             'host': os.environ['REDSHIFT_HOST'],
             'user': os.environ['REDSHIFT_USER'],
@@ -67,15 +374,89 @@ class RedshiftConnector:
             'port': os.environ['REDSHIFT_PORT'],
             'database': os.environ['REDSHIFT_DATABASE']
         }
+        self.idle = []  # (connection, time it was last used)
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, last_used = self.idle.pop()
+            if not conn.closed and (time.monotonic() - last_used < HEALTH_CHECK_INTERVAL or self.is_alive(conn)):
+                return conn
+            self.close_connection(conn)
+        conn = psycopg2.connect(**self.redshift_config)
+        # no transaction is left open between queries, and a failed query does not abort the next one
+        conn.autocommit = True
+        return conn
+
+    def release(self, conn):
+        if not conn.closed:
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+
+    @staticmethod
+    def is_alive(conn) -> bool:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def close_connection(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self.close_connection(conn)
 
+    def slot(self):
+        """Context manager waiting for one of the max_concurrency query slots."""
+        return self.slots if self.slots is not None else nullcontext()
 
-    def exec_query(self, query) -> pd.DataFrame:
-        with psycopg2.connect(**self.redshift_config) as conn:
+    def exec_query(self, query, cancel=None) -> pd.DataFrame:
+        conn = self.acquire()
+        try:
+            if cancel is not None:
+                cancel.register(conn.cancel)
             return pd.read_sql(query, conn)
+        except Exception:
+            if not conn.closed or (cancel is not None and cancel.cancelled):
+                raise
+            # the connection was lost (idle timeout, cluster restart): run the query once more
+            conn = self.acquire()
+            if cancel is not None:
+                cancel.register(conn.cancel)
+            return pd.read_sql(query, conn)
+        finally:
+            self.release(conn)
 
 
 class SnowflakeConnector:
-    def __init__(self):
+    """
+    Snowflake session pool kept for the life of the process.
+
+    The SQLAlchemy engine is created on the first query and its pool keeps the sessions logged in;
+    pool_pre_ping checks a session before it is reused and replaces it if it was closed.
+    With max_concurrency, at most that many queries run at the same time in slot().
+    Use as a context manager, or call close(), to log out.
+    """
+    def __init__(self, max_concurrency=None):
         self.snowflake_config = {
             'user': os.environ['SNOWFLAKE_USER'],
             'password': os.environ['SNOWFLAKE_PASSWORD'],
@@ -84,9 +465,43 @@ class SnowflakeConnector:
             'database': os.environ['SNOWFLAKE_DATABASE'],
             'role': os.environ['SNOWFLAKE_ROLE']
         }
+        self.engine = None
+        self.lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_engine(self):
+        with self.lock:
+            if self.engine is None:
+                # keep a session per concurrent query (the overflow covers cancel requests)
+                self.engine = create_engine(URL(**self.snowflake_config), pool_pre_ping=True,
+                                            pool_size=max(5, self.max_concurrency or 0))
+            return self.engine
+
+    def close(self):
+        with self.lock:
+            if self.engine is not None:
+                self.engine.dispose()
+                self.engine = None
+
+    def cancel_session(self, session_id):
+        # a running query can only be cancelled from another session
+        with self.get_engine().connect() as conn:
+            conn.exec_driver_sql(f'SELECT SYSTEM$CANCEL_ALL_QUERIES({int(session_id)})')
 
+    def slot(self):
+        """Context manager waiting for one of the max_concurrency query slots."""
+        return self.slots if self.slots is not None else nullcontext()
 
-    def exec_query(self, query) -> pd.DataFrame:
+    def exec_query(self, query, cancel=None) -> pd.DataFrame:
         # SQLAlchemy sets columns lower case
-        with create_engine(URL(**self.snowflake_config)).connect() as conn:
+        with self.get_engine().connect() as conn:
+            if cancel is not None:
+                cancel.register(partial(self.cancel_session, conn.connection.dbapi_connection.session_id))
             return pd.read_sql(query, conn)
@@ -5,14 +5,11 @@ import os
 import time
 import warnings
 
-import numpy as np
 import pandas as pd
 import pytz
-from diff_checker_base import (RedshiftConnector, SnowflakeConnector,
-                               exec_query_redshift, exec_query_snowflake,
-                               setup_logger)
+from diff_checker_base import (RedshiftConnector, SnowflakeConnector, compare_rows, compare_values,
+                               exec_queries, format_value_diff, setup_logger, sort_rows)
 from dotenv import load_dotenv
-from pandas.testing import assert_frame_equal
 
 load_dotenv()
 warnings.simplefilter('ignore')
@@ -46,29 +43,28 @@ def compare_result(sql_redshift: str, sql_snowflake: str, result: dict):
     df_redshift, df_snowflake = None, None
     time_redshift, time_snowflake = None, None
     try:
-        logger.debug(f'Execute sql on Snowflake')
-        df_snowflake, time_snowflake = exec_query_snowflake(snowflake_conn, sql_snowflake)
-        logger.debug(f'Execute sql on Redshift')
-        df_redshift, time_redshift = exec_query_redshift(redshift_conn, sql_redshift)
+        logger.debug(f'Execute sql on Snowflake and Redshift')
+        (df_redshift, time_redshift), (df_snowflake, time_snowflake) = \
+            exec_queries(redshift_conn, sql_redshift, snowflake_conn, sql_snowflake)
 
         if len(df_redshift) == 0 or len(df_snowflake) == 0:
             logger.warn(f'{len(df_redshift)=} {len(df_snowflake)=}')
             raise Exception(f'No data. {df_redshift=}, {df_snowflake=}')
 
-        sort_columns: list = df_redshift.columns.tolist()  # use columns of Redshift table
-        df_snowflake = df_snowflake.sort_values(sort_columns).reset_index(drop=True)[sort_columns]
-        df_redshift = df_redshift.sort_values(sort_columns).reset_index(drop=True)[sort_columns]
+        columns: list = df_redshift.columns.tolist()  # use columns of Redshift table
+        df_snowflake = df_snowflake[columns]
         assert_flg = 1
-        # Confirm that the number of digits (including integer part and decimal part) is the same within 13 digits
-        # (atol is absolute error, rtol is relative error)
-        assert_frame_equal(df_redshift, df_snowflake, check_dtype=False, atol=1e-13, rtol=1e-13)
-
-        redshift_row_count: int = df_redshift.iat[0, 0]
-        snowflake_row_count: int = df_snowflake.iat[0, 0]
-        if redshift_row_count == 0 or snowflake_row_count == 0:
-            logger.warn(f'Redshift row count: {redshift_row_count}')
-            logger.warn(f'Snowflake row count: {snowflake_row_count}')
-            raise Exception(f'No data. {redshift_row_count=}, {snowflake_row_count=}')
+        # Compare the rows as multisets of row hashes, independent of the row order
+        # (integers are compared exactly, other numbers to about 12 significant digits)
+        row_diff: dict = compare_rows(df_redshift, df_snowflake)
+        result.update({
+            'rows_missing_in_snowflake': row_diff['missing_in_snowflake'],
+            'rows_extra_in_snowflake': row_diff['extra_in_snowflake'],
+        })
+        if row_diff['missing_in_snowflake'] or row_diff['extra_in_snowflake']:
+            raise AssertionError(f"{row_diff['missing_in_snowflake']} rows missing in Snowflake, "
+                                 f"{row_diff['extra_in_snowflake']} extra rows in Snowflake")
+
         pd.set_option('display.max_columns', 100)
         pd.set_option('display.max_rows', 1000)
         pd.set_option('display.width', 200)
@@ -90,22 +86,15 @@ def compare_result(sql_redshift: str, sql_snowflake: str, result: dict):
     except Exception as ex:
         result['is_data_equal'] = False
         result['message'] = ex
-        if assert_flg:  # Error after assert_frame_equal
-            if df_redshift.iat[0, 0] != 0:  # Redshift row count is not 0
-                err_rate_max, col_max = 0.0, ''
-                for i, col in enumerate(list(df_redshift.columns)):
-                    sf_val, rs_val = df_snowflake.iat[0, i], df_redshift.iat[0, i]
-                    # Get the error rate for numeric columns
-                    if (type(sf_val) and type(rs_val)) in [np.int64, np.float64]:
-                        err_rate: float = abs(sf_val - rs_val) / rs_val * 100
-                        err_rate_max, col_max = (err_rate, col) if err_rate_max < err_rate else (err_rate_max, col_max)
-
-                err_rate_str: str = f'{"{:.12f}".format(err_rate_max)}%.' if err_rate_max != 0 else '0%.'
-                judge, err_rate_print = \
-                    ('OK', f'{err_rate_str} {col_max}') if err_rate_max <= err_rate_threshold \
-                        else ('NG', f'{err_rate_str} {col_max}')
-            else:  # Row count 0 error
-                judge, err_rate_print = 'NG', '-'
+        if assert_flg:  # Error after compare_rows
+            # line up the rows of both results to get the error rate
+            df_redshift, df_snowflake = sort_rows(df_redshift), sort_rows(df_snowflake)
+            # Compare all cells at once: numbers within the error rate threshold, other values and NULLs exactly
+            value_diff: dict = compare_values(df_redshift, df_snowflake, err_rate_threshold)
+            err_rate_max, col_max = value_diff['max_error_rate'], value_diff['max_error_column']
+            err_rate_str: str = f'{"{:.12f}".format(err_rate_max)}%.' if err_rate_max != 0 else '0%.'
+            judge, err_rate_print = ('OK' if value_diff['mismatches'] == 0 else 'NG'), f'{err_rate_str} {col_max}'
+            result['diff_columns'] = format_value_diff(value_diff)
 
             result.update(
                 {
@@ -149,6 +138,9 @@ def get_sql_default_result(dir: str, file_name: str) -> dict:
         'is_data_equal': '-',
         'is_error': True,
         'message': '',
+        'rows_missing_in_snowflake': '-',
+        'rows_extra_in_snowflake': '-',
+        'diff_columns': '',
         'diff_rate': '-',
         f'result(<= {err_rate_threshold}%)': 'NG',
     }
@@ -177,6 +169,8 @@ def format_excel(diff_results_df: pd.DataFrame, excel_writer: pd.ExcelWriter):
     sheet.set_column(col_idx, col_idx, 11)
     col_idx = columns.get_loc('message')
     sheet.set_column(col_idx, col_idx, 16)
+    col_idx = columns.get_loc('diff_columns')
+    sheet.set_column(col_idx, col_idx, 30)
     col_idx = columns.get_loc('diff_rate')
     sheet.set_column(col_idx, col_idx, 22)
     col_idx = columns.get_loc(f'result(<= {err_rate_threshold}%)')
@@ -195,48 +189,50 @@ if __name__ == '__main__':
     diff_results: list[dict] = []
     sqls: list[str] = []
     logger.info(f'Compare sql result data. {args.sql_dirs=}')
-    for sql_dir in args.sql_dirs:
-        redshift_dir = os.path.join(sql_dir, 'redshift')
-        snowflake_dir = os.path.join(sql_dir, 'snowflake')
-        files: list[str] = os.listdir(redshift_dir)
-        sql_files: list[str] = [f for f in files
-                             if os.path.isfile(os.path.join(redshift_dir, f)) and f.endswith('.sql')]
-
-        logger.info(f'Compare sql result data. {sql_files=}')
-
-        # compare sql results
-        for sql_file in sql_files:
-            logger.info(f'{sql_file=}')
-            with open(f'{redshift_dir}/{sql_file}') as file:
-                sql_redshift = file.read()
-            with open(f'{snowflake_dir}/{sql_file}') as file:
-                sql_snowflake = file.read()
-
-            # set params
-            with open(args.sql_param_file) as json_file:
-                sql_params = json.load(json_file)
-                sql_redshift = set_params(sql_redshift, sql_params)
-                sql_snowflake = set_params(sql_snowflake, sql_params)
-
-            try:
-                default_result = get_sql_default_result(sql_dir, file.name)
-                result = compare_result(sql_redshift, sql_snowflake, default_result)
-                diff_results.append(result)
-            except Exception as e:
-                diff_results.append({
-                    'file_name': file.name,
-                    'sql_redshift': '',
-                    'sql_snowflake': '',
-                    'result_redshift': '-',
-                    'result_snowflake': '-',
-                    'time_redshift': '-',
-                    'time_snowflake': '-',
-                    'is_data_equal': False,
-                    'is_error': str(e),
-                    'diff_rate': '-',
-                    f'result(<= {err_rate_threshold}%)': 'NG'
-                })
-                logger.error(f'Error. {file.name=}', e)
+    # the connections are kept open for all comparisons and closed at the end
+    with redshift_conn, snowflake_conn:
+        for sql_dir in args.sql_dirs:
+            redshift_dir = os.path.join(sql_dir, 'redshift')
+            snowflake_dir = os.path.join(sql_dir, 'snowflake')
+            files: list[str] = os.listdir(redshift_dir)
+            sql_files: list[str] = [f for f in files
+                                 if os.path.isfile(os.path.join(redshift_dir, f)) and f.endswith('.sql')]
+
+            logger.info(f'Compare sql result data. {sql_files=}')
+
+            # compare sql results
+            for sql_file in sql_files:
+                logger.info(f'{sql_file=}')
+                with open(f'{redshift_dir}/{sql_file}') as file:
+                    sql_redshift = file.read()
+                with open(f'{snowflake_dir}/{sql_file}') as file:
+                    sql_snowflake = file.read()
+
+                # set params
+                with open(args.sql_param_file) as json_file:
+                    sql_params = json.load(json_file)
+                    sql_redshift = set_params(sql_redshift, sql_params)
+                    sql_snowflake = set_params(sql_snowflake, sql_params)
+
+                try:
+                    default_result = get_sql_default_result(sql_dir, file.name)
+                    result = compare_result(sql_redshift, sql_snowflake, default_result)
+                    diff_results.append(result)
+                except Exception as e:
+                    diff_results.append({
+                        'file_name': file.name,
+                        'sql_redshift': '',
+                        'sql_snowflake': '',
+                        'result_redshift': '-',
+                        'result_snowflake': '-',
+                        'time_redshift': '-',
+                        'time_snowflake': '-',
+                        'is_data_equal': False,
+                        'is_error': str(e),
+                        'diff_rate': '-',
+                        f'result(<= {err_rate_threshold}%)': 'NG'
+                    })
+                    logger.error(f'Error. {file.name=}', e)
 
     diff_results_df = pd.DataFrame(diff_results)
     now = datetime.datetime.now(pytz.timezone(os.getenv('TIME_ZONE')))
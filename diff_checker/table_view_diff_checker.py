@@ -1,17 +1,22 @@
 import argparse
 import datetime
 import os
+import re
+import sys
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
 import pandas as pd
 import pytz
-from diff_checker_base import (RedshiftConnector, SnowflakeConnector,
-                               exec_query_redshift, exec_query_snowflake,
-                               setup_logger)
+from bucket_checksum import compare_checksums
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'redshift_ddl_getter'))
+from catalog_snapshot import CatalogSnapshot
+from diff_checker_base import (RedshiftConnector, SnowflakeConnector, compare_rows, compare_values,
+                               exec_in_slot, exec_queries,
+                               exec_query_redshift, format_value_diff, setup_logger, sort_rows)
 from dotenv import load_dotenv
-from pandas.testing import assert_frame_equal
 from tqdm import tqdm
 
 load_dotenv()
@@ -20,6 +25,22 @@ warnings.simplefilter('ignore')
 parser = argparse.ArgumentParser(description='Compare redshift and snowflake table or view.')
 parser.add_argument('--table_view_list_csv', nargs='*',
                     help='table or view list csv file name', type=str, required=True)
+parser.add_argument('--parallel', type=int, default=1,
+                    help='number of tables or views compared at the same time (default: 1)')
+parser.add_argument('--redshift_concurrency', type=int,
+                    help='maximum number of queries running on Redshift at the same time, e.g. the WLM queue slots '
+                         '(default: --parallel)')
+parser.add_argument('--snowflake_concurrency', type=int,
+                    help='maximum number of queries running on Snowflake at the same time (default: --parallel)')
+parser.add_argument('--checksum', action='store_true',
+                    help='compare per-bucket row checksums computed on both engines and drill down into the buckets '
+                         'that differ, instead of comparing column aggregates')
+parser.add_argument('--checksum_leaf_rows', type=int, default=1000,
+                    help='with --checksum, fetch and compare the rows of differing buckets of at most this many rows '
+                         '(default: 1000)')
+parser.add_argument('--catalog_snapshot', action='store_true',
+                    help='read the columns from the catalog snapshot (CATALOG_SNAPSHOT_PATH) and refresh only its '
+                         'entries older than CATALOG_SNAPSHOT_TTL seconds')
 
 args = parser.parse_args()
 now = datetime.datetime.now(pytz.timezone(os.getenv('TIME_ZONE')))
@@ -31,8 +52,8 @@ logger.info('----------------------------------------------------')
 exclude_columns = os.getenv('TABLE_VIEW_DIFF_CHECKER_EXCLUDED_COLUMNS').split(',')
 err_rate_threshold = float(os.getenv('DIFF_CHECKER_ERROR_RATE_THRESHOLD', '0.0001'))
 
-snowflake_conn = SnowflakeConnector()
-redshift_conn = RedshiftConnector()
+snowflake_conn = SnowflakeConnector(max_concurrency=args.snowflake_concurrency or args.parallel)
+redshift_conn = RedshiftConnector(max_concurrency=args.redshift_concurrency or args.parallel)
 
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
@@ -45,21 +66,27 @@ def compare_result(table_view: dict, sql_redshift: str, sql_snowflake: str, resu
     time_redshift, time_snowflake = None, None
     try:
         logger.debug(f'Execute sql on Snowflake\n{sql_snowflake}')
-        df_snowflake, time_snowflake = exec_query_snowflake(snowflake_conn, sql_snowflake)
         logger.debug(f'Execute sql on Redshift\n{sql_redshift}')
-        df_redshift, time_redshift = exec_query_redshift(redshift_conn, sql_redshift)
+        (df_redshift, time_redshift), (df_snowflake, time_snowflake) = \
+            exec_queries(redshift_conn, sql_redshift, snowflake_conn, sql_snowflake)
 
         if len(df_redshift) == 0 or len(df_snowflake) == 0:
             logger.warn(f'{len(df_redshift)=} {len(df_snowflake)=}')
             raise Exception(f'No data. {df_redshift=}, {df_snowflake=}')
 
-        sort_columns: list = df_redshift.columns.tolist()  # use columns of Redshift table
-        df_snowflake = df_snowflake.sort_values(sort_columns).reset_index(drop=True)[sort_columns]
-        df_redshift = df_redshift.sort_values(sort_columns).reset_index(drop=True)[sort_columns]
+        columns: list = df_redshift.columns.tolist()  # use columns of Redshift table
+        df_snowflake = df_snowflake[columns]
         assert_flg = 1
-        # Confirm that the number of digits (including integer part and decimal part) is the same within 13 digits
-        # (atol is absolute error, rtol is relative error)
-        assert_frame_equal(df_redshift, df_snowflake, check_dtype=False, atol=1e-13, rtol=1e-13)
+        # Compare the rows as multisets of row hashes, independent of the row order
+        # (integers are compared exactly, other numbers to about 12 significant digits)
+        row_diff: dict = compare_rows(df_redshift, df_snowflake)
+        result.update({
+            'rows_missing_in_snowflake': row_diff['missing_in_snowflake'],
+            'rows_extra_in_snowflake': row_diff['extra_in_snowflake'],
+        })
+        if row_diff['missing_in_snowflake'] or row_diff['extra_in_snowflake']:
+            raise AssertionError(f"{row_diff['missing_in_snowflake']} rows missing in Snowflake, "
+                                 f"{row_diff['extra_in_snowflake']} extra rows in Snowflake")
 
         # For table comparison, select count(*) and select sum(column_name) if numeric type for each column,
         # otherwise select min(column name), max(column name), count(distinct column name) comparison
@@ -90,20 +117,16 @@ def compare_result(table_view: dict, sql_redshift: str, sql_snowflake: str, resu
     except Exception as ex:
         result['is_data_equal'] = False
         result['message'] = ex
-        if assert_flg:  # Error after assert_frame_equal
+        if assert_flg:  # Error after compare_rows
+            # line up the rows of both results to get the error rate
+            df_redshift, df_snowflake = sort_rows(df_redshift), sort_rows(df_snowflake)
             if df_redshift.iat[0, 0] != 0:  # Redshift row count is not 0
-                err_rate_max, col_max = 0.0, ''
-                for i, col in enumerate(list(df_redshift.columns)):
-                    sf_val, rs_val = df_snowflake.iat[0, i], df_redshift.iat[0, i]
-                    # Get the error rate for numeric columns
-                    if (type(sf_val) and type(rs_val)) in [np.int64, np.float64]:
-                        err_rate: float = abs(sf_val - rs_val) / rs_val * 100
-                        err_rate_max, col_max = (err_rate, col) if err_rate_max < err_rate else (err_rate_max, col_max)
-
+                # Compare all cells at once: numbers within the error rate threshold, other values and NULLs exactly
+                value_diff: dict = compare_values(df_redshift, df_snowflake, err_rate_threshold)
+                err_rate_max, col_max = value_diff['max_error_rate'], value_diff['max_error_column']
                 err_rate_str: str = f'{"{:.12f}".format(err_rate_max)}%.' if err_rate_max != 0 else '0%.'
-                judge, err_rate_print = \
-                    ('OK', f'{err_rate_str} {col_max}') if err_rate_max <= err_rate_threshold \
-                        else ('NG', f'{err_rate_str} {col_max}')
+                judge, err_rate_print = ('OK' if value_diff['mismatches'] == 0 else 'NG'), f'{err_rate_str} {col_max}'
+                result['diff_columns'] = format_value_diff(value_diff)
             else:  # Row count 0 error
                 judge, err_rate_print = 'NG', '-'
 
@@ -149,12 +172,70 @@ def get_table_default_result(table_view_name: str) ->  dict:
         'is_data_equal': '-',
         'is_error': True,
         'message': '',
+        'rows_missing_in_snowflake': '-',
+        'rows_extra_in_snowflake': '-',
+        'diff_columns': '',
         'diff_rate': '-',
         f'result(<= {err_rate_threshold}%)': 'NG',
     }
     return default_result
 
 
+# schema.table => DataFrame of column_name, data_type, loaded for all tables and views by load_columns()
+column_index: dict = {}
+
+
+def load_columns(table_view_names: list):
+    """Read the columns of all tables and views from information_schema in one query into column_index."""
+    names = {name.strip().lower() for name in table_view_names}
+    if args.catalog_snapshot:
+        return load_columns_from_snapshot(names)
+    schemas = sorted({name.split('.')[0] for name in names if '.' in name})
+    if not schemas:
+        return
+    schema_list = ', '.join(f"'{schema}'" for schema in schemas)
+    sql_redshift = f"SELECT table_schema, table_name, column_name, data_type FROM information_schema.columns " \
+                   f"WHERE table_schema IN ({schema_list}) ORDER BY table_schema, table_name, ordinal_position"
+    df_redshift, time_redshift = exec_in_slot(redshift_conn, exec_query_redshift, sql_redshift)
+    df_redshift['name'] = df_redshift['table_schema'] + '.' + df_redshift['table_name']
+    df_redshift = df_redshift[df_redshift['name'].isin(names)]
+    for name, columns in df_redshift.groupby('name', sort=False):
+        column_index[name] = columns[['column_name', 'data_type']].reset_index(drop=True)
+    logger.info(f'Columns of {len(column_index)} tables or views read in {round(time_redshift, 2)} sec.')
+
+
+def load_columns_from_snapshot(names: set):
+    """--catalog_snapshot: fill column_index from the catalog snapshot, refreshing its stale entries."""
+    connections = []
+
+    def connect():
+        connections.append(redshift_conn.acquire())
+        return connections[-1].cursor()
+
+    try:
+        entries: dict = CatalogSnapshot().get(names, connect)
+    finally:
+        for conn in connections:
+            redshift_conn.release(conn)
+    for name, entry in entries.items():
+        # format_type() => information_schema data_type, e.g. numeric(18,2) => numeric
+        column_index[name] = pd.DataFrame([(column, re.sub(r'\(.*\)$', '', data_type))
+                                           for column, data_type in entry['columns']],
+                                          columns=['column_name', 'data_type'])
+    logger.info(f'Columns of {len(column_index)} tables or views read from the catalog snapshot.')
+
+
+def get_columns(table_view_name: str) -> pd.DataFrame:
+    """column_name, data_type of a table or view, from column_index once load_columns() has run."""
+    if column_index:
+        return column_index.get(table_view_name.strip().lower(),
+                                pd.DataFrame(columns=['column_name', 'data_type']))
+    sql_redshift = f"SELECT column_name, data_type FROM information_schema.columns " \
+                   f"WHERE table_schema || '.' || table_name = '{table_view_name}' ORDER BY ordinal_position"
+    df_redshift, _ = exec_in_slot(redshift_conn, exec_query_redshift, sql_redshift)
+    return df_redshift
+
+
 def compare_table_results(table_view: dict) -> dict:
     logger.info(f'{table_view=}')
     table_view_name: str = table_view['name']
@@ -166,9 +247,10 @@ def compare_table_results(table_view: dict) -> dict:
     int_columns = ['SMALLINT', 'INT2', 'INTEGER', 'INT', 'INT4', 'BIGINT', 'INT8', 'DECIMAL', 'NUMERIC']
 
     # get column names and types from redshift.
-    sql_redshift = f"SELECT column_name, data_type FROM information_schema.columns " \
-                   f"WHERE table_schema || '.' || table_name = '{table_view_name}'"
-    df_redshift, time_redshift = exec_query_redshift(redshift_conn, sql_redshift)
+    df_redshift = get_columns(table_view_name)
+    if args.checksum:
+        columns = [(row.iloc[0], row.iloc[1]) for _, row in df_redshift.iterrows() if row.iloc[0] not in exclude_columns]
+        return compare_table_checksums(table_view, columns, result)
     query = 'SELECT COUNT(*) AS count_all,'
     for index, row in df_redshift.iterrows():
         column_type: str = row.iloc[1].upper()
@@ -194,6 +276,57 @@ def compare_table_results(table_view: dict) -> dict:
 
     return compare_result(table_view, query, query, result)
 
+
+def compare_table_checksums(table_view: dict, columns: list, result: dict) -> dict:
+    """--checksum: locate differing rows from per-bucket checksums (see bucket_checksum.py)."""
+    try:
+        report = compare_checksums(redshift_conn, snowflake_conn, table_view['name'], table_view['where'], columns,
+                                   table_view['key'], args.checksum_leaf_rows)
+        # buckets that differ only in how their values render hold no differing rows
+        is_data_equal = report['rows_missing_in_snowflake'] == 0 and report['rows_extra_in_snowflake'] == 0
+        result.update(
+            {
+                'query_redshift': f"{report['queries']} checksum queries",
+                'query_snowflake': f"{report['queries']} checksum queries",
+                'result_redshift': f"{report['buckets']} buckets, {report['differing_buckets']} differing",
+                'result_snowflake': f"{report['buckets']} buckets, {report['differing_buckets']} differing",
+                'time_redshift': round(report['time_redshift'], 2),
+                'time_snowflake': round(report['time_snowflake'], 2),
+                'is_data_equal': is_data_equal,
+                'is_error': False,
+                'message': '' if is_data_equal else
+                f"missing in Snowflake: {report['missing_rows']}\nextra in Snowflake: {report['extra_rows']}",
+                'rows_missing_in_snowflake': report['rows_missing_in_snowflake'],
+                'rows_extra_in_snowflake': report['rows_extra_in_snowflake'],
+                f'result(<= {err_rate_threshold}%)': 'OK' if is_data_equal else 'NG'
+            }
+        )
+    except Exception as ex:
+        result.update({'is_data_equal': False, 'message': ex, 'is_error': True})
+        logger.exception(ex)
+    return result
+
+
+def compare_table(table_view: dict) -> dict:
+    try:
+        return compare_table_results(table_view)
+    except Exception as e:
+        logger.error(f'Error. {table_view=}', e)
+        return {
+            'table/view': table_view['name'],
+            'query_redshift': '',
+            'query_snowflake': '',
+            'result_redshift': '-',
+            'result_snowflake': '-',
+            'time_redshift': '-',
+            'time_snowflake': '-',
+            'is_data_equal': False,
+            'is_error': str(e),
+            'diff_rate': '-',
+            f'result(<= {err_rate_threshold}%)': 'NG'
+        }
+
+
 def format_excel(diff_results_df: pd.DataFrame, excel_writer: pd.ExcelWriter):
     sheet = excel_writer.sheets['Diff results']
     columns = diff_results_df.columns
@@ -216,6 +349,8 @@ def format_excel(diff_results_df: pd.DataFrame, excel_writer: pd.ExcelWriter):
     sheet.set_column(col_idx, col_idx, 11)
     col_idx = columns.get_loc('message')
     sheet.set_column(col_idx, col_idx, 16)
+    col_idx = columns.get_loc('diff_columns')
+    sheet.set_column(col_idx, col_idx, 30)
     col_idx = columns.get_loc('diff_rate')
     sheet.set_column(col_idx, col_idx, 22)
     col_idx = columns.get_loc(f'result(<= {err_rate_threshold}%)')
@@ -230,31 +365,18 @@ if __name__ == '__main__':
     for csv in args.table_view_list_csv:
         with open(csv) as f:
             lines = f.read()
-            table_view_list = [{'name': line.split(',')[0], 'where': line.split(',')[1]}
+            table_view_list = [{'name': line.split(',')[0], 'where': line.split(',')[1],
+                                'key': line.split(',')[2].strip() if len(line.split(',')) > 2 else None}
                                for line in lines.split('\n')[1:] if line and not line.startswith('#')]
         table_views.extend(table_view_list)
 
     logger.info(f'{table_views=}')
-    # compare data each tables or views
-    for table_view in tqdm(table_views):
-        try:
-            res = compare_table_results(table_view)
-            diff_results.append(res)
-        except Exception as e:
-            diff_results.append({
-                'table/view': table_view['name'],
-                'query_redshift': '',
-                'query_snowflake': '',
-                'result_redshift': '-',
-                'result_snowflake': '-',
-                'time_redshift': '-',
-                'time_snowflake': '-',
-                'is_data_equal': False,
-                'is_error': str(e),
-                'diff_rate': '-',
-                f'result(<= {err_rate_threshold}%)': 'NG'
-            })
-            logger.error(f'Error. {table_view=}', e)
+    # the connections are kept open for all comparisons and closed at the end
+    with redshift_conn, snowflake_conn:
+        load_columns([table_view['name'] for table_view in table_views])
+        # compare data each tables or views, --parallel at a time; the results keep the order of the csv
+        with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+            diff_results.extend(tqdm(executor.map(compare_table, table_views), total=len(table_views)))
 
     diff_results_df = pd.DataFrame(diff_results)
     now = datetime.datetime.now(pytz.timezone(os.getenv('TIME_ZONE')))
@@ -0,0 +1,136 @@
+"""
+On-disk snapshot of the Redshift catalog, shared by the DDL getters and the diff checker.
+
+For every table and view it keeps the columns (name, type) in ordinal order, the row-count estimate of
+pg_class, the OID and the fingerprint used by --incremental, with the time they were read, plus the list of
+all tables and of all views that list-file patterns are expanded against. The snapshot is a gzip-compressed
+JSON file (CATALOG_SNAPSHOT_PATH). Entries and lists older than CATALOG_SNAPSHOT_TTL seconds, or missing,
+are read again with one catalog read for all of them; the others are served from the file, so a run on a
+fresh snapshot (the diff checker, or a getter with --dry_run) does not touch the catalog at all.
+
+Objects that do not exist are not remembered, so a new table listed by name is seen by the next run; a new
+table matched only by a pattern is seen once the list is refreshed. Change detection (--incremental) must
+not trust a cached entry: fingerprints() always reads the catalog and refreshes the snapshot with it.
+"""
+import gzip
+import json
+import os
+import time
+from pathlib import Path
+
+from redshift_catalog import (fetch_object_names, fetch_snapshot_entries, load_manifest, manifest_path, object_key,
+                              resolve_names, unchanged_objects)
+
+DEFAULT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'catalog_snapshot.json.gz')
+DEFAULT_TTL = float(os.getenv('CATALOG_SNAPSHOT_TTL', 24 * 60 * 60))
+# kind => relkind
+RELKINDS = {'table': 'r', 'view': 'v'}
+
+
+class CatalogSnapshot:
+    def __init__(self, path=None, ttl=None):
+        self.path = Path(path or DEFAULT_PATH)
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.entries, self.listings = self.load()
+
+    def load(self):
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return {}, {}
+        if 'entries' not in snapshot:
+            # older versions kept only the entries
+            return snapshot, {}
+        return snapshot['entries'], snapshot['listings']
+
+    def save(self):
+        tmp = Path(f"{self.path}.tmp")
+        with gzip.open(tmp, 'wt') as f:
+            json.dump({'entries': self.entries, 'listings': self.listings}, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def is_stale(self, key, ttl):
+        entry = self.entries.get(key)
+        # entries of objects that did not exist were kept by older versions
+        return entry is None or entry.get('kind') is None or time.time() - entry['fetched_at'] > ttl
+
+    def get(self, names, connect, ttl=None):
+        """
+        {normalized name: entry} of the tables and views among `names`.
+
+        Entries older than `ttl` (the snapshot TTL by default) and missing ones are refreshed first;
+        connect() returns a cursor and is only called then.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        keys = {object_key(name) for name in names}
+        stale = sorted(key for key in keys if self.is_stale(key, ttl))
+        if stale:
+            fetched_at = time.time()
+            entries = fetch_snapshot_entries(connect(), stale)
+            for key in stale:
+                if key in entries:
+                    self.entries[key] = {**entries[key], 'fetched_at': fetched_at}
+                else:
+                    self.entries.pop(key, None)
+            self.save()
+        return {key: self.entries[key] for key in keys if key in self.entries}
+
+    def names(self, kind, connect, ttl=None):
+        """
+        "schema.name" of every object of `kind` ('table' or 'view'), to expand list-file patterns against.
+
+        Read again in one query when older than `ttl` (the snapshot TTL by default).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        listing = self.listings.get(kind)
+        if listing is None or time.time() - listing['fetched_at'] > ttl:
+            fetched_at = time.time()
+            listing = self.listings[kind] = {'names': fetch_object_names(connect(), RELKINDS[kind]),
+                                             'fetched_at': fetched_at}
+            self.save()
+        return listing['names']
+
+    def fingerprints(self, names, connect, kind):
+        """
+        {normalized name: fingerprint} of the objects of `kind` ('table' or 'view') among `names`.
+
+        Always read from the catalog (in one query) so no change is missed; the snapshot is refreshed with it.
+        """
+        return {key: entry['fingerprint'] for key, entry in self.get(names, connect, ttl=0).items()
+                if entry['kind'] == kind and entry.get('fingerprint')}
+
+    def dry_run(self, list_entries, excludes, kind, connect, output_root, incremental):
+        """
+        --dry_run of the getters: print the objects of `kind` that a run would write, or skip as unchanged
+        with `incremental`, with their columns and row-count estimates, from the snapshot alone.
+
+        Patterns are expanded against the snapshot's list of objects. The catalog is read only for
+        stale entries, so unlike fingerprints() a change made within the TTL is not seen. Returns the
+        number of objects that would be written.
+        """
+        cursors = []
+
+        def connect_once():
+            if not cursors:
+                cursors.append(connect())
+            return cursors[0]
+
+        names = resolve_names(None, list_entries, excludes, RELKINDS[kind], self.names(kind, connect_once))
+        entries = {key: entry for key, entry in self.get(names, connect_once).items() if entry['kind'] == kind}
+        fingerprints = {key: entry.get('fingerprint') for key, entry in entries.items()}
+        unchanged = set()
+        if incremental:
+            unchanged = unchanged_objects(names, fingerprints, load_manifest(manifest_path(output_root)), output_root)
+        written = 0
+        for name in names:
+            entry = entries.get(object_key(name))
+            if entry is None:
+                print(f"{name}\tmissing")
+                continue
+            status = 'unchanged' if name in unchanged else 'write'
+            written += status == 'write'
+            print(f"{name}\t{status}\t{len(entry['columns'])} columns\t{entry['rows']} rows")
+        print(f"{written} of {len(names)} {kind}s would be written "
+              f"({'catalog read' if cursors else 'from the snapshot only'}).")
+        return written
@@ -0,0 +1,306 @@
+"""
+Bulk DDL extraction from the Redshift catalog.
+
+Instead of one "show table" / "show view" round trip per object, the definitions of all requested objects
+are read with a few set-based catalog queries and the DDL is rebuilt client-side:
+
+  views:  pg_get_viewdef() for every view in one query
+  tables: pg_class (distribution style), pg_attribute (columns, encodings, dist and sort keys),
+          pg_attrdef (defaults) and pg_constraint (primary and unique keys), one query each
+
+List files may contain patterns (analytics.*, mart_%.fact_?, re:^stg_.*) that are expanded against the
+catalog in one query, with the exclusions applied as a set difference in the same query.
+
+For incremental runs (--incremental) a manifest next to the output directory maps every object to a
+fingerprint of its catalog entry, read for all objects in one query, so unchanged objects are skipped.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+# pg_class.reldiststyle => DISTSTYLE
+DISTSTYLES = {0: 'EVEN', 1: 'KEY', 8: 'ALL', 9: 'AUTO', 10: 'AUTO', 11: 'AUTO'}
+
+simple_identifier_re = re.compile('^[a-z_][a-z0-9_$]*$')
+
+
+def object_key(name):
+    """Normalized "schema.name" of a list file entry such as "Schema"."Name" or schema.name."""
+    return name.replace('"', '').strip().lower()
+
+
+def quote_ident(name):
+    return name if simple_identifier_re.match(name) else '"{0}"'.format(name.replace('"', '""'))
+
+
+def is_pattern(entry):
+    """True for list entries with a glob wildcard (* ? %) or a "re:" regular expression."""
+    return entry.startswith('re:') or any(c in entry for c in '*?%')
+
+
+def pattern_regex(entry):
+    """
+    Anchored regular expression of a list pattern, matched against lowercase "schema.name".
+
+    Glob wildcards do not cross the dot, and a pattern without a schema matches the name in every schema.
+    """
+    if entry.startswith('re:'):
+        return entry[3:]
+    key = object_key(entry)
+    regex = ''.join('[^.]*' if c in '*%' else '[^.]' if c == '?' else re.escape(c) for c in key)
+    if '.' not in key:
+        regex = '[^.]*[.]' + regex
+    return f'^{regex}$'
+
+
+def resolve_names(cursor, entries, excludes, relkind, listing=None):
+    """
+    Expand the patterns among the list entries into "schema.name" of the catalog objects of `relkind`.
+
+    All patterns are resolved in one query, excluding the objects matched by `excludes` (names or patterns),
+    or against `listing` (the fetch_object_names() of `relkind`, e.g. from the catalog snapshot) without
+    a query. Plain entries are kept as they are and in their order, so objects that do not exist are still
+    reported. Without patterns no query is run.
+    """
+    includes = [pattern_regex(entry) for entry in entries if is_pattern(entry)]
+    exclude_patterns = [pattern_regex(entry) for entry in excludes if is_pattern(entry)]
+    exclude_names = {object_key(entry) for entry in excludes if entry and not is_pattern(entry)}
+    names = [entry for entry in entries
+             if not is_pattern(entry)
+             and object_key(entry) not in exclude_names
+             and not any(re.search(regex, object_key(entry), re.IGNORECASE) for regex in exclude_patterns)]
+    if not includes:
+        return names
+
+    if listing is not None:
+        matches = [name for name in listing
+                   if any(re.search(regex, object_key(name), re.IGNORECASE) for regex in includes)
+                   and not any(re.search(regex, object_key(name), re.IGNORECASE) for regex in exclude_patterns)
+                   and object_key(name) not in exclude_names]
+        return add_names(names, matches)
+
+    cursor.execute("""
+        select n.nspname, c.relname
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.relkind = %s
+          and n.nspname not in ('pg_catalog', 'information_schema')
+          and lower(n.nspname || '.' || c.relname) ~* any(%s)
+          and not lower(n.nspname || '.' || c.relname) ~* any(%s)
+          and lower(n.nspname || '.' || c.relname) <> all(%s)
+        order by n.nspname, c.relname
+    """, (relkind, includes, exclude_patterns, list(exclude_names)))
+    return add_names(names, [f'{quote_ident(schema)}.{quote_ident(name)}' for schema, name in cursor.fetchall()])
+
+
+def add_names(names, matches):
+    """`names` followed by the pattern `matches` that are not among them."""
+    known = {object_key(name) for name in names}
+    for name in matches:
+        if object_key(name) not in known:
+            known.add(object_key(name))
+            names.append(name)
+    return names
+
+
+def fetch_object_names(cursor, relkind):
+    """"schema.name" of every catalog object of `relkind` outside the system schemas, in one query."""
+    cursor.execute("""
+        select n.nspname, c.relname
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.relkind = %s
+          and n.nspname not in ('pg_catalog', 'information_schema')
+        order by n.nspname, c.relname
+    """, (relkind,))
+    return [f'{quote_ident(schema)}.{quote_ident(name)}' for schema, name in cursor.fetchall()]
+
+
+def fetch_view_ddls(cursor, names):
+    """{normalized name: definition} of the views among `names`, in one query."""
+    cursor.execute("""
+        select n.nspname, c.relname, pg_get_viewdef(c.oid, true)
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.relkind = 'v'
+          and lower(n.nspname || '.' || c.relname) = any(%s)
+    """, ([object_key(name) for name in names],))
+    return {object_key(f'{schema}.{view}'): definition for schema, view, definition in cursor.fetchall()}
+
+
+def fetch_table_ddls(cursor, names):
+    """{normalized name: CREATE TABLE statement} of the tables among `names`, in three queries."""
+    keys = [object_key(name) for name in names]
+    cursor.execute("""
+        select c.oid, n.nspname, c.relname, c.reldiststyle
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.relkind = 'r'
+          and lower(n.nspname || '.' || c.relname) = any(%s)
+    """, (keys,))
+    tables = {oid: {'schema': schema, 'table': table, 'diststyle': diststyle, 'columns': [], 'constraints': []}
+              for oid, schema, table, diststyle in cursor.fetchall()}
+    if not tables:
+        return {}
+    oids = list(tables)
+
+    cursor.execute("""
+        select a.attrelid, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull,
+               pg_get_expr(d.adbin, d.adrelid), format_encoding(a.attencodingtype::integer),
+               a.attisdistkey, a.attsortkeyord
+        from pg_attribute a
+        left join pg_attrdef d on d.adrelid = a.attrelid and d.adnum = a.attnum
+        where a.attrelid = any(%s)
+          and a.attnum > 0
+          and not a.attisdropped
+        order by a.attrelid, a.attnum
+    """, (oids,))
+    for row in cursor.fetchall():
+        tables[row[0]]['columns'].append(row[1:])
+
+    cursor.execute("""
+        select conrelid, pg_get_constraintdef(oid)
+        from pg_constraint
+        where conrelid = any(%s)
+          and contype in ('p', 'u')
+        order by conrelid, conname
+    """, (oids,))
+    for oid, constraint in cursor.fetchall():
+        tables[oid]['constraints'].append(constraint)
+
+    return {object_key(f"{table['schema']}.{table['table']}"): build_table_ddl(table) for table in tables.values()}
+
+
+def build_table_ddl(table):
+    """CREATE TABLE statement in the layout of "show table"."""
+    lines = []
+    sortkeys = []
+    for name, data_type, notnull, default, encoding, distkey, sortkey in table['columns']:
+        line = f"    {quote_ident(name)} {data_type}"
+        if default is not None:
+            line += f" DEFAULT {default}"
+        if notnull:
+            line += " NOT NULL"
+        if encoding and encoding != 'none':
+            line += f" ENCODE {encoding}"
+        if distkey:
+            line += " distkey"
+        lines.append(line)
+        if sortkey:
+            sortkeys.append((abs(sortkey), sortkey < 0, quote_ident(name)))
+    lines += [f"    {constraint}" for constraint in table['constraints']]
+
+    ddl = f"CREATE TABLE {quote_ident(table['schema'])}.{quote_ident(table['table'])} (\n"
+    ddl += ",\n".join(lines) + "\n)\n"
+    ddl += f"DISTSTYLE {DISTSTYLES.get(table['diststyle'], 'AUTO')}"
+    if sortkeys:
+        interleaved = 'INTERLEAVED ' if any(negative for _, negative, _ in sortkeys) else ''
+        ddl += f"\n{interleaved}SORTKEY ( {', '.join(name for _, _, name in sorted(sortkeys))} )"
+    return ddl + ";"
+
+
+def fetch_view_fingerprints(cursor, names):
+    """{normalized name: fingerprint} of the views among `names`: a hash of the OID and definition, in one query."""
+    cursor.execute("""
+        select n.nspname, c.relname, c.oid, pg_get_viewdef(c.oid, true)
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where c.relkind = 'v'
+          and lower(n.nspname || '.' || c.relname) = any(%s)
+    """, ([object_key(name) for name in names],))
+    return {object_key(f'{schema}.{view}'): hashlib.sha256(f'{oid}\n{definition}'.encode()).hexdigest()
+            for schema, view, oid, definition in cursor.fetchall()}
+
+
+def fetch_table_fingerprints(cursor, names):
+    """
+    {normalized name: fingerprint} of the tables among `names`, in one query.
+
+    The fingerprint is a hash of the OID, the distribution style and the columns with their types,
+    defaults, encodings and dist/sort keys, so any ALTER TABLE or re-creation changes it.
+    """
+    cursor.execute("""
+        select n.nspname, c.relname, c.oid, c.reldiststyle, a.attname, format_type(a.atttypid, a.atttypmod),
+               a.attnotnull, pg_get_expr(d.adbin, d.adrelid), a.attencodingtype, a.attisdistkey, a.attsortkeyord
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        join pg_attribute a on a.attrelid = c.oid and a.attnum > 0 and not a.attisdropped
+        left join pg_attrdef d on d.adrelid = a.attrelid and d.adnum = a.attnum
+        where c.relkind = 'r'
+          and lower(n.nspname || '.' || c.relname) = any(%s)
+        order by c.oid, a.attnum
+    """, ([object_key(name) for name in names],))
+    digests = {}
+    for schema, table, *column in cursor.fetchall():
+        digests.setdefault(object_key(f'{schema}.{table}'), hashlib.sha256()).update(repr(column).encode())
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def fetch_snapshot_entries(cursor, names):
+    """
+    Catalog snapshot entries of the tables and views among `names` (see catalog_snapshot.py): kind, OID,
+    columns (name, type) in ordinal order, row-count estimate and the --incremental fingerprint.
+
+    One query for all objects, plus one for the definitions of the views.
+    """
+    cursor.execute("""
+        select n.nspname, c.relname, c.relkind, c.reltuples,
+               c.oid, c.reldiststyle, a.attname, format_type(a.atttypid, a.atttypmod),
+               a.attnotnull, pg_get_expr(d.adbin, d.adrelid), a.attencodingtype, a.attisdistkey, a.attsortkeyord
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        left join pg_attribute a on a.attrelid = c.oid and a.attnum > 0 and not a.attisdropped
+        left join pg_attrdef d on d.adrelid = a.attrelid and d.adnum = a.attnum
+        where c.relkind in ('r', 'v')
+          and lower(n.nspname || '.' || c.relname) = any(%s)
+        order by c.oid, a.attnum
+    """, ([object_key(name) for name in names],))
+    entries = {}
+    digests = {}
+    for schema, name, relkind, reltuples, *column in cursor.fetchall():
+        key = object_key(f'{schema}.{name}')
+        entry = entries.setdefault(key, {'kind': 'table' if relkind == 'r' else 'view', 'oid': column[0],
+                                         'rows': int(reltuples or 0), 'columns': []})
+        if column[2] is not None:
+            entry['columns'].append([column[2], column[3]])
+            # the same digest as fetch_table_fingerprints()
+            digests.setdefault(key, hashlib.sha256()).update(repr(column).encode())
+    for key, digest in digests.items():
+        if entries[key]['kind'] == 'table':
+            entries[key]['fingerprint'] = digest.hexdigest()
+    views = [key for key, entry in entries.items() if entry['kind'] == 'view']
+    if views:
+        for key, fingerprint in fetch_view_fingerprints(cursor, views).items():
+            entries[key]['fingerprint'] = fingerprint
+    return entries
+
+
+def manifest_path(output_root):
+    """Manifest of an output directory, e.g. table/ => table.manifest.json."""
+    output_root = Path(output_root).resolve()
+    return output_root.with_name(f"{output_root.name}.manifest.json")
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def unchanged_objects(names, fingerprints, manifest, output_root):
+    """Names whose fingerprint matches the manifest and whose DDL file is still there."""
+    return {name for name in names
+            if fingerprints.get(object_key(name)) is not None
+            and manifest.get(object_key(name)) == fingerprints[object_key(name)]
+            and Path(output_root, f"{name}.sql").exists()}
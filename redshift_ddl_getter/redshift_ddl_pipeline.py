@@ -0,0 +1,169 @@
+"""
+Extract DDL from Redshift and convert it to Snowflake in one run.
+
+Every DDL is handed to a pool of converter processes as soon as it is fetched, so the Redshift queries overlap
+the conversion and the DDL tree does not have to be written and read back by a separate sql_converter run.
+The raw DDL is written as by the getters unless --no_raw is given.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'sql_converter'))
+
+from redshift_catalog import fetch_table_ddls, fetch_view_ddls, object_key, resolve_names
+from redshift_table_ddl_getter import show_table, table_ddl
+from redshift_view_ddl_getter import show_view, view_ddl
+from sql_converter import convert_string
+
+host = os.environ['REDSHIFT_HOST']
+port = os.environ['REDSHIFT_PORT']
+dbname = os.environ['REDSHIFT_DATABASE']
+user = os.environ['REDSHIFT_USER']
+password = os.environ['REDSHIFT_PASSWORD']
+
+# kind => (show query, bulk catalog query, raw file layout, relkind)
+KINDS = {
+    'table': (show_table, fetch_table_ddls, table_ddl, 'r'),
+    'view': (show_view, fetch_view_ddls, view_ddl, 'v'),
+}
+
+
+def read_list(path):
+    if not path or not Path(path).exists():
+        return []
+    with open(path, 'r') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def fetch_ddls(conn, kind, names, bulk):
+    """Yield (name, DDL or exception) in list order, one "show" query at a time or from one bulk fetch."""
+    show, fetch_bulk, _, _ = KINDS[kind]
+    cursor = conn.cursor()
+    if bulk:
+        try:
+            ddls = fetch_bulk(cursor, names)
+        except Exception as e:
+            print(f"can not read the catalog, falling back to show {kind}.", file=sys.stderr)
+            print(e, file=sys.stderr)
+            conn.rollback()
+        else:
+            for name in names:
+                yield name, ddls.get(object_key(name)) or KeyError(name)
+            return
+    for name in names:
+        try:
+            yield name, show(cursor, name)
+        except Exception as e:
+            conn.rollback()
+            yield name, e
+
+
+def run(args):
+    converter = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    # converted DDL waiting to be written, in list order: (raw file name, output path, future or text)
+    pending = deque()
+    errors = []
+    counts = {'fetched': 0, 'converted': 0}
+
+    def write_converted(block):
+        while pending and (block or not hasattr(pending[0][2], 'done') or pending[0][2].done()):
+            filename, dest_sql_path, converted = pending.popleft()
+            try:
+                snowflake_sql = converted.result() if hasattr(converted, 'result') else converted
+            except Exception as e:
+                print(f"can not convert {filename}! continue.", file=sys.stderr)
+                print(e, file=sys.stderr)
+                errors.append(f"can not convert {filename}! continue.\n")
+                continue
+            with open(dest_sql_path, 'w') as dest_sql_file:
+                dest_sql_file.write(snowflake_sql)
+            counts['converted'] += 1
+
+    conn = psycopg2.connect(f"host={host} port={port} dbname={dbname} user={user} password={password}")
+    conn.autocommit = False
+    start = time.perf_counter()
+    try:
+        for kind, list_path, exclude_path, raw_dir in (
+                ('table', args.table_list, args.exclude_table_list, args.table_dir),
+                ('view', args.view_list, args.exclude_view_list, args.view_dir)):
+            excludes = {line.lower() for line in read_list(exclude_path)}
+            names = resolve_names(conn.cursor(), read_list(list_path), excludes, KINDS[kind][3])
+            print(f"{len(names)} {kind}s to extract.")
+            ddl_text = KINDS[kind][2]
+            for name, sql in fetch_ddls(conn, kind, names, args.bulk):
+                if isinstance(sql, Exception):
+                    print(f"can not write {name} ddl! continue.", file=sys.stderr)
+                    print(sql, file=sys.stderr)
+                    errors.append(f"can not write {name} ddl! continue.\n")
+                    continue
+                counts['fetched'] += 1
+                text = ddl_text(name, sql)
+                raw_sql_path = Path(raw_dir, f"{name}.sql")
+                if not args.no_raw:
+                    os.makedirs(raw_dir, exist_ok=True)
+                    with open(raw_sql_path, 'w') as ddl_file:
+                        ddl_file.write(text)
+
+                # the raw file path is the name the converter would see when converting the raw directory
+                convert_args = (text, args.no_comments, args.engine, str(raw_sql_path), args.statements)
+                pending.append((str(raw_sql_path), Path(args.outputdir, f"{name}.sql"),
+                                converter.submit(convert_string, *convert_args) if converter
+                                else convert_string(*convert_args)))
+                write_converted(block=False)
+        write_converted(block=True)
+    finally:
+        conn.close()
+        if converter:
+            converter.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print(f"{counts['fetched']} objects extracted and {counts['converted']} converted in {elapsed:.1f}s "
+          f"({counts['converted'] / elapsed if elapsed else 0:.1f} objects/sec)")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract DDL from Redshift and convert it to Snowflake in one run.')
+    parser.add_argument('--table_list', action='store', default="redshift_ddl_getter/table_list.txt",
+                        help='list of tables or patterns (default: "redshift_ddl_getter/table_list.txt")')
+    parser.add_argument('--view_list', action='store', default="redshift_ddl_getter/view_list.txt",
+                        help='list of views or patterns (default: "redshift_ddl_getter/view_list.txt")')
+    parser.add_argument('--exclude_table_list', action='store', default="redshift_ddl_getter/exclude_table_list.txt",
+                        help='excluded tables or patterns (default: "redshift_ddl_getter/exclude_table_list.txt")')
+    parser.add_argument('--exclude_view_list', action='store', default="redshift_ddl_getter/exclude_view_list.txt",
+                        help='excluded views or patterns (default: "redshift_ddl_getter/exclude_view_list.txt")')
+    parser.add_argument('--table_dir', action='store', default="redshift_ddl_getter/table",
+                        help='directory of the raw table DDL (default: "redshift_ddl_getter/table")')
+    parser.add_argument('--view_dir', action='store', default="redshift_ddl_getter/view",
+                        help='directory of the raw view DDL (default: "redshift_ddl_getter/view")')
+    parser.add_argument('--no_raw', action='store_true',
+                        help='write only the converted DDL, not the raw Redshift DDL')
+    parser.add_argument('--outputdir', action='store', default="sql_converter/snowflake-sql",
+                        help='output SQL file directory in Snowflake dialect (default: "sql_converter/snowflake-sql")')
+    parser.add_argument('--no_comments', action='store_true',
+                        help='suppress comments with changes (default: show changes)')
+    parser.add_argument('--engine', action='store', choices=['regex', 'tokenizer'], default='regex',
+                        help='conversion engine (default: "regex")')
+    parser.add_argument('--statements', action='store_true',
+                        help='convert statement by statement')
+    parser.add_argument('--jobs', action='store', type=int, default=os.cpu_count() or 1,
+                        help='number of converter processes (default: number of CPUs)')
+    parser.add_argument('--bulk', action='store_true',
+                        help='read the definitions with a few catalog queries instead of one "show" query per object')
+    args = parser.parse_args()
+
+    os.makedirs(args.outputdir, exist_ok=True)
+    errors = run(args)
+
+    # Write the list of errors to a file
+    if errors:
+        with open(Path(args.outputdir, "pipeline.err"), 'w') as error_file:
+            error_file.writelines(errors)
+        sys.exit(1)
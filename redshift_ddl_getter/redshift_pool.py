@@ -0,0 +1,62 @@
+"""
+Bounded pool of Redshift connections for the DDL getters (--workers N).
+
+Each worker thread takes a connection on first use and keeps its own transaction, so a failed query
+only rolls back the transaction of that worker. The connection of the caller, idle while the pool runs,
+serves one of the workers, so at most N connections are open at a time.
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+
+
+def fetch_all(conn_string, names, fetch, workers, conn=None):
+    """
+    Run fetch(cursor, name) for every name on a pool of `workers` connections.
+
+    `conn`, the connection of the caller, is used by one of the workers and left open.
+    Returns ({name: result}, {name: exception}) and reports progress as objects/sec on stderr.
+    """
+    local = threading.local()
+    # connections opened by the pool, closed at the end
+    connections = []
+    spare = [conn] if conn is not None else []
+    lock = threading.Lock()
+
+    def run(name):
+        if getattr(local, 'conn', None) is None:
+            with lock:
+                worker_conn = spare.pop() if spare else None
+            if worker_conn is None:
+                worker_conn = psycopg2.connect(conn_string)
+                worker_conn.autocommit = False
+                with lock:
+                    connections.append(worker_conn)
+            local.conn = worker_conn
+        try:
+            return fetch(local.conn.cursor(), name)
+        except Exception:
+            local.conn.rollback()
+            raise
+
+    results = {}
+    errors = {}
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run, name): name for name in names}
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    errors[futures[future]] = e
+                if done % 100 == 0 or done == len(futures):
+                    elapsed = time.perf_counter() - start
+                    print(f"{done}/{len(futures)} objects, {done / elapsed:.1f} objects/sec", file=sys.stderr)
+    finally:
+        for worker_conn in connections:
+            worker_conn.close()
+    return results, errors
@@ -2,6 +2,12 @@ import psycopg2
 from pathlib import Path
 import sys
 import os
+import time
+
+from catalog_snapshot import CatalogSnapshot
+from redshift_catalog import (fetch_table_ddls, fetch_table_fingerprints, is_pattern, load_manifest, manifest_path,
+                              object_key, resolve_names, save_manifest, unchanged_objects)
+from redshift_pool import fetch_all
 
 host = os.environ['REDSHIFT_HOST']
 port = os.environ['REDSHIFT_PORT']
@@ -10,13 +16,35 @@ user = os.environ['REDSHIFT_USER']
 password = os.environ['REDSHIFT_PASSWORD']
 
 
+def show_table(cursor, table):
+    # Execute a "show table" query for the table
+    cursor.execute(f"show table {dbname}.{table}")
+    return cursor.fetchone()[0]
+
+
+def table_ddl(table, sql):
+    return f"create table {table} as\n{sql}\n"
+
+
 def main(args):
     """
     Export DDL for the specified tables from RedShift to the specified directory.
 
-    args[1]: Input: A file list containing "schema"."table_name"
+    args[1]: Input: A file list containing "schema"."table_name", or patterns such as analytics.*,
+             mart_%.fact_? or re:^stg_ that are expanded against the catalog
     args[2]: Output: Directory for outputting DDL files
-    args[3]: Optional: Excluded table list file
+    args[3]: Optional: Excluded table list file (names or patterns)
+    --bulk: Optional: read the definitions of all tables with a few catalog queries instead of
+            one "show table" query per table (see redshift_catalog.py)
+    --workers N: Optional: run the "show table" queries on a pool of N connections
+    --incremental: Optional: skip tables whose catalog fingerprint has not changed since the last run
+                   (table.manifest.json next to the output directory)
+    --catalog_snapshot: Optional: expand the patterns against the list of tables in the catalog snapshot
+                        (read again when older than CATALOG_SNAPSHOT_TTL), and with --incremental also
+                        refresh the snapshot with the fingerprints read (see catalog_snapshot.py)
+    --dry_run: Optional: only print the tables that would be written (or skipped with --incremental)
+               with their columns and row estimates, from the catalog snapshot; the catalog is read
+               only for the snapshot entries older than CATALOG_SNAPSHOT_TTL
     
     The output files will be named "schema"."table_name".sql for each table.
     tables listed in the excluded table list file will not have DDL generated.
@@ -24,6 +52,16 @@ def main(args):
     """
 
     # Get the output directory from command-line arguments
+    bulk = '--bulk' in args
+    incremental = '--incremental' in args
+    catalog_snapshot = '--catalog_snapshot' in args
+    dry_run = '--dry_run' in args
+    args = [arg for arg in args if arg not in ('--bulk', '--incremental', '--catalog_snapshot', '--dry_run')]
+    workers = 1
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
     output_root = args[2]
 
     # Connect to the Redshift database
@@ -32,10 +70,6 @@ def main(args):
         # Redshift connection string
         conn_string = f"host={host} port={port} dbname={dbname} user={user} password={password}"
 
-        conn = psycopg2.connect(conn_string)
-        conn.autocommit = False
-        cursor = conn.cursor()
-
         # Initialize the set of tables to ignore
         ignore_table = set()
 
@@ -46,30 +80,91 @@ def main(args):
 
         # Read the table list file
         with open(args[1], 'r') as table_list_file:
-            for table in table_list_file:
-                table = table.rstrip('\n')
-
-                # Process only tables that are not in the ignore_table set
-                if table not in ignore_table:
-                    print(f'{table=}')
-                    try:
-                        # Execute a "show table" query for the current table
-                        cursor.execute(f"show table {dbname}.{table}")
-                        result = cursor.fetchone()
-
-                        # Write the table's DDL to a file
-                        os.makedirs(Path(output_root), exist_ok=True)
-                        with open(Path(output_root, f"{table}.sql"), 'w') as ddl_file:
-                            sql = result[0]
-                            ddl_file.write(f"create table {table} as\n")
-                            ddl_file.write(sql)
-                            ddl_file.write("\n")
-                    except Exception as e:
-                        # If an error occurs, log the error and continue with the next table
-                        print(f"can not write {table} ddl! continue.", file=sys.stderr)
-                        error_list.append(f"can not write {table} ddl! continue.\n")
-                        print(e, file=sys.stderr)
-                        conn.rollback()
+            tables = [table.rstrip('\n') for table in table_list_file]
+
+        if dry_run:
+            # Report from the catalog snapshot, connecting only to refresh its stale entries
+            CatalogSnapshot().dry_run(tables, ignore_table, 'table', lambda: psycopg2.connect(conn_string).cursor(),
+                                      output_root, incremental)
+            return
+
+        conn = psycopg2.connect(conn_string)
+        conn.autocommit = False
+        cursor = conn.cursor()
+
+        # Expand the patterns in the list and drop the excluded tables in one catalog query (or the snapshot)
+        patterns = sum(1 for table in tables if is_pattern(table))
+        snapshot = CatalogSnapshot() if catalog_snapshot else None
+        listing = snapshot.names('table', lambda: cursor) if snapshot and patterns else None
+        tables = resolve_names(cursor, tables, ignore_table, 'r', listing)
+        if patterns:
+            print(f"{patterns} patterns resolved to {len(tables)} tables.")
+
+        start = time.perf_counter()
+
+        # Skip the tables whose fingerprint is the same as in the manifest of the last run
+        if incremental:
+            manifest_file = manifest_path(output_root)
+            manifest = load_manifest(manifest_file)
+            targets = [table for table in tables if table not in ignore_table]
+            if catalog_snapshot:
+                fingerprints = snapshot.fingerprints(targets, lambda: cursor, 'table')
+            else:
+                fingerprints = fetch_table_fingerprints(cursor, targets)
+            unchanged = unchanged_objects(tables, fingerprints, manifest, output_root)
+            print(f"{len(unchanged)} tables unchanged since the last run.")
+            ignore_table = ignore_table | unchanged
+
+        # Read the DDL of all tables at once
+        if bulk:
+            try:
+                ddls = fetch_table_ddls(cursor, [table for table in tables if table not in ignore_table])
+            except Exception as e:
+                print("can not read the catalog, falling back to show table.", file=sys.stderr)
+                print(e, file=sys.stderr)
+                conn.rollback()
+                bulk = False
+        elif workers > 1:
+            ddls, failures = fetch_all(conn_string, [table for table in tables if table not in ignore_table],
+                                       show_table, workers, conn)
+
+        written = 0
+        for table in tables:
+            # Process only tables that are not in the ignore_table set
+            if table not in ignore_table:
+                print(f'{table=}')
+                try:
+                    if bulk:
+                        # Tables missing from the catalog end up in table.err like failed "show table" queries
+                        sql = ddls[object_key(table)]
+                    elif workers > 1:
+                        if table in failures:
+                            raise failures[table]
+                        sql = ddls[table]
+                    else:
+                        sql = show_table(cursor, table)
+
+                    # Write the table's DDL to a file
+                    os.makedirs(Path(output_root), exist_ok=True)
+                    with open(Path(output_root, f"{table}.sql"), 'w') as ddl_file:
+                        ddl_file.write(table_ddl(table, sql))
+                    written += 1
+                    if incremental:
+                        manifest[object_key(table)] = fingerprints.get(object_key(table))
+                except Exception as e:
+                    # If an error occurs, log the error and continue with the next table
+                    print(f"can not write {table} ddl! continue.", file=sys.stderr)
+                    error_list.append(f"can not write {table} ddl! continue.\n")
+                    print(e, file=sys.stderr)
+                    conn.rollback()
+                    if incremental:
+                        manifest.pop(object_key(table), None)
+
+        if incremental:
+            save_manifest(manifest_file, {name: fingerprint for name, fingerprint in manifest.items() if fingerprint})
+
+        elapsed = time.perf_counter() - start
+        print(f"{written} tables written in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f} objects/sec)")
 
     # Handle connection errors
     except Exception as e:
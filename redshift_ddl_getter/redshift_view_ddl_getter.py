@@ -2,6 +2,12 @@ import psycopg2
 from pathlib import Path
 import sys
 import os
+import time
+
+from catalog_snapshot import CatalogSnapshot
+from redshift_catalog import (fetch_view_ddls, fetch_view_fingerprints, is_pattern, load_manifest, manifest_path,
+                              object_key, resolve_names, save_manifest, unchanged_objects)
+from redshift_pool import fetch_all
 
 host = os.environ['REDSHIFT_HOST']
 port = os.environ['REDSHIFT_PORT']
@@ -10,19 +16,54 @@ user = os.environ['REDSHIFT_USER']
 password = os.environ['REDSHIFT_PASSWORD']
 
 
+def show_view(cursor, view):
+    # Execute a "show view" query for the view
+    cursor.execute(f"show view {dbname}.{view}")
+    return cursor.fetchone()[0]
+
+
+def view_ddl(view, sql):
+    # Add a "create view" statement if it's not a materialized view
+    if 'MATERIALIZED' not in sql.upper():
+        return f"create view {view} as\n{sql}\n"
+    return f"{sql}\n"
+
+
 def main(args):
     """
     Export DDL for the specified views from RedShift to the specified directory.
 
-    args[1]: Input: A file list containing "schema"."view_name"
+    args[1]: Input: A file list containing "schema"."view_name", or patterns such as analytics.*,
+             mart_%.fact_? or re:^stg_ that are expanded against the catalog
     args[2]: Output: Directory for outputting DDL files
-    args[3]: Optional: Excluded view list file
+    args[3]: Optional: Excluded view list file (names or patterns)
+    --bulk: Optional: read the definitions of all views with a few catalog queries instead of
+            one "show view" query per view (see redshift_catalog.py)
+    --workers N: Optional: run the "show view" queries on a pool of N connections
+    --incremental: Optional: skip views whose catalog fingerprint has not changed since the last run
+                   (view.manifest.json next to the output directory)
+    --catalog_snapshot: Optional: expand the patterns against the list of views in the catalog snapshot
+                        (read again when older than CATALOG_SNAPSHOT_TTL), and with --incremental also
+                        refresh the snapshot with the fingerprints read (see catalog_snapshot.py)
+    --dry_run: Optional: only print the views that would be written (or skipped with --incremental)
+               with their columns and row estimates, from the catalog snapshot; the catalog is read
+               only for the snapshot entries older than CATALOG_SNAPSHOT_TTL
     
     The output files will be named "schema"."view_name".sql for each view.
     Views listed in the excluded view list file will not have DDL generated.
     Views that could not be output will be listed in a "view.err" file in the output directory.
     """
     # Get the output directory from command-line arguments
+    bulk = '--bulk' in args
+    incremental = '--incremental' in args
+    catalog_snapshot = '--catalog_snapshot' in args
+    dry_run = '--dry_run' in args
+    args = [arg for arg in args if arg not in ('--bulk', '--incremental', '--catalog_snapshot', '--dry_run')]
+    workers = 1
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
     output_root = args[2]
 
     # Connect to the Redshift database
@@ -31,10 +72,6 @@ def main(args):
         # Redshift connection string
         conn_string = f"host={host} port={port} dbname={dbname} user={user} password={password}"
 
-        conn = psycopg2.connect(conn_string)
-        conn.autocommit = False
-        cursor = conn.cursor()
-
         # Initialize the set of views to ignore
         ignore_view = set()
 
@@ -45,32 +82,91 @@ def main(args):
 
         # Read the view list file
         with open(args[1], 'r') as view_list_file:
-            for view in view_list_file:
-                view = view.rstrip('\n')
-
-                # Process only views that are not in the ignore_view set
-                if view not in ignore_view:
-                    print(f'{view=}')
-                    try:
-                        # Execute a "show view" query for the current view
-                        cursor.execute(f"show view {dbname}.{view}")
-                        result = cursor.fetchone()
-
-                        # Write the view's DDL to a file
-                        os.makedirs(Path(output_root), exist_ok=True)
-                        with open(Path(output_root, f"{view}.sql"), 'w') as ddl_file:
-                            sql = result[0]
-                            # Write a "create view" statement if it's not a materialized view
-                            if 'MATERIALIZED' not in sql.upper():
-                                ddl_file.write(f"create view {view} as\n")
-                            ddl_file.write(sql)
-                            ddl_file.write("\n")
-                    except Exception as e:
-                        # If an error occurs, log the error and continue with the next view
-                        print(f"can not write {view} ddl! continue.", file=sys.stderr)
-                        error_list.append(f"can not write {view} ddl! continue.\n")
-                        print(e, file=sys.stderr)
-                        conn.rollback()
+            views = [view.rstrip('\n') for view in view_list_file]
+
+        if dry_run:
+            # Report from the catalog snapshot, connecting only to refresh its stale entries
+            CatalogSnapshot().dry_run(views, ignore_view, 'view', lambda: psycopg2.connect(conn_string).cursor(),
+                                      output_root, incremental)
+            return
+
+        conn = psycopg2.connect(conn_string)
+        conn.autocommit = False
+        cursor = conn.cursor()
+
+        # Expand the patterns in the list and drop the excluded views in one catalog query (or the snapshot)
+        patterns = sum(1 for view in views if is_pattern(view))
+        snapshot = CatalogSnapshot() if catalog_snapshot else None
+        listing = snapshot.names('view', lambda: cursor) if snapshot and patterns else None
+        views = resolve_names(cursor, views, ignore_view, 'v', listing)
+        if patterns:
+            print(f"{patterns} patterns resolved to {len(views)} views.")
+
+        start = time.perf_counter()
+
+        # Skip the views whose fingerprint is the same as in the manifest of the last run
+        if incremental:
+            manifest_file = manifest_path(output_root)
+            manifest = load_manifest(manifest_file)
+            targets = [view for view in views if view not in ignore_view]
+            if catalog_snapshot:
+                fingerprints = snapshot.fingerprints(targets, lambda: cursor, 'view')
+            else:
+                fingerprints = fetch_view_fingerprints(cursor, targets)
+            unchanged = unchanged_objects(views, fingerprints, manifest, output_root)
+            print(f"{len(unchanged)} views unchanged since the last run.")
+            ignore_view = ignore_view | unchanged
+
+        # Read the DDL of all views at once
+        if bulk:
+            try:
+                ddls = fetch_view_ddls(cursor, [view for view in views if view not in ignore_view])
+            except Exception as e:
+                print("can not read the catalog, falling back to show view.", file=sys.stderr)
+                print(e, file=sys.stderr)
+                conn.rollback()
+                bulk = False
+        elif workers > 1:
+            ddls, failures = fetch_all(conn_string, [view for view in views if view not in ignore_view],
+                                       show_view, workers, conn)
+
+        written = 0
+        for view in views:
+            # Process only views that are not in the ignore_view set
+            if view not in ignore_view:
+                print(f'{view=}')
+                try:
+                    if bulk:
+                        # Views missing from the catalog end up in view.err like failed "show view" queries
+                        sql = ddls[object_key(view)]
+                    elif workers > 1:
+                        if view in failures:
+                            raise failures[view]
+                        sql = ddls[view]
+                    else:
+                        sql = show_view(cursor, view)
+
+                    # Write the view's DDL to a file
+                    os.makedirs(Path(output_root), exist_ok=True)
+                    with open(Path(output_root, f"{view}.sql"), 'w') as ddl_file:
+                        ddl_file.write(view_ddl(view, sql))
+                    written += 1
+                    if incremental:
+                        manifest[object_key(view)] = fingerprints.get(object_key(view))
+                except Exception as e:
+                    # If an error occurs, log the error and continue with the next view
+                    print(f"can not write {view} ddl! continue.", file=sys.stderr)
+                    error_list.append(f"can not write {view} ddl! continue.\n")
+                    print(e, file=sys.stderr)
+                    conn.rollback()
+                    if incremental:
+                        manifest.pop(object_key(view), None)
+
+        if incremental:
+            save_manifest(manifest_file, {name: fingerprint for name, fingerprint in manifest.items() if fingerprint})
+
+        elapsed = time.perf_counter() - start
+        print(f"{written} views written in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f} objects/sec)")
 
     # Handle connection errors
     except Exception as e:
@@ -0,0 +1,211 @@
+def usage():
+    print("""\
+# Usage: sql_benchmark.py [--corpus {dir}] [--files {n}] [--seed {n}] [--engine {regex|tokenizer}] [--statements] [--output {json}]
+    """)
+
+
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+if __package__:
+    from .sql_converter import convert_lines, decode_sql
+else:
+    from sql_converter import convert_lines, decode_sql
+
+### Synthetic Redshift SQL
+TYPES = ['integer', 'bigint', 'smallint', 'numeric(18,2)', 'decimal(10,0)', 'double precision', 'real',
+         'varchar(256)', 'character varying(64)', 'char(1)', 'nvarchar(100)', 'bpchar', 'text', 'boolean',
+         'date', 'timestamp', 'timestamp without time zone', 'int(11)', 'bigint unsigned']
+ENCODES = ['az64', 'zstd', 'lzo', 'raw', 'bytedict', 'delta', 'runlength', 'text255']
+WORDS = ['user', 'order', 'item', 'shop', 'event', 'session', 'campaign', 'payment', 'device', 'region']
+JAPANESE = ['売上', '顧客', '注文', '商品', '店舗', '集計', '日付', '金額']
+
+
+def name(rng, prefix=''):
+    return f"{prefix}{rng.choice(WORDS)}_{rng.choice(WORDS)}{rng.randint(1, 99)}"
+
+
+def ddl(rng):
+    table = name(rng)
+    columns = [f"  id bigint NOT NULL ENCODE az64 DISTKEY"]
+    for _ in range(rng.randint(3, 30)):
+        column = f"  {name(rng)} {rng.choice(TYPES)}"
+        if rng.random() < 0.3:
+            column += " NOT NULL"
+        if rng.random() < 0.2:
+            column += rng.choice([" DEFAULT sysdate", " DEFAULT 0", " DEFAULT ''", " DEFAULT getdate()"])
+        if rng.random() < 0.8:
+            column += f" ENCODE {rng.choice(ENCODES)}"
+        columns.append(column)
+    sortkey = ', '.join(['id'] + [name(rng) for _ in range(rng.randint(0, 3))])
+    lines = [f"CREATE TABLE IF NOT EXISTS public.{table}", "(", ',\n'.join(columns), ")",
+             f"DISTSTYLE KEY",
+             f"{rng.choice(['', 'INTERLEAVED ', 'COMPOUND '])}SORTKEY ({sortkey});",
+             f"ALTER TABLE public.{table} owner to etl_user;",
+             f"GRANT SELECT ON public.{table} TO GROUP readers;"]
+    return '\n'.join(lines)
+
+
+def view(rng):
+    lines = [f"CREATE OR REPLACE VIEW {name(rng, 'v_')} AS",
+             f"SELECT a.id, nvl(a.{name(rng)}, 0) AS total, trunc(sysdate,'MM')-1 AS prior_month,",
+             f"  convert_timezone('JST', a.created_at) AS created_jst, b.{name(rng)}::varchar",
+             f"FROM public.{name(rng)} a",
+             f"LEFT JOIN public.{name(rng)} b ON a.id = b.id",
+             f"WHERE a.created_at >= dateadd(day, -7, getdate())",
+             "WITH NO SCHEMA BINDING;"]
+    return '\n'.join(lines)
+
+
+def redash(rng):
+    lines = [f"-- {name(rng)} overview",
+             f"select {{{{ Schema }}}}.{name(rng)}.id::text as id,",
+             f"  flags << 2 as shifted, flags >> 1 & 3 as bits,",
+             f"  amount::numeric(18,2) / nullif(count::float, 0) as ratio,",
+             f"  '{rng.choice(WORDS)}' + {name(rng)} as label,",
+             f"  json_extract_path_text(payload, '{rng.choice(WORDS)}') as value",
+             f"from {{{{ Schema }}}}.{name(rng)}",
+             f"where created_at between '{{{{ start_date }}}}'::date and '{{{{ end_date }}}}'::date",
+             f"  and {name(rng)} similar to '%({rng.choice(WORDS)}|{rng.choice(WORDS)})%'",
+             "order by 1;"]
+    return '\n'.join(lines)
+
+
+def listagg(rng):
+    lines = [f"select {name(rng)},",
+             f"  listagg(distinct {name(rng)}, ',') within group (order by {name(rng)}) as items,",
+             f"  listagg({name(rng)}, '|') as raw_items,",
+             f"  avg({name(rng)}) over (partition by id order by created_at",
+             f"    rows between unbounded preceding and unbounded following) as running_avg",
+             f"from public.{name(rng)}",
+             "group by 1;"]
+    return '\n'.join(lines)
+
+
+def long_line(rng):
+    # generated queries: huge IN lists and minified SELECTs on a single line
+    # (kept to a few KB: the regex engine is quadratic in the line length)
+    values = ', '.join(str(rng.randint(1, 10 ** 9)) for _ in range(rng.randint(100, 400)))
+    columns = ', '.join(f"nvl({name(rng)}, 0)::bigint" for _ in range(rng.randint(10, 40)))
+    return f"select {columns} from public.{name(rng)} where id in ({values});"
+
+
+def japanese(rng):
+    lines = [f"-- {rng.choice(JAPANESE)}{rng.choice(JAPANESE)}の{rng.choice(JAPANESE)}",
+             f"select {name(rng)} as \"{rng.choice(JAPANESE)}\", '{rng.choice(JAPANESE)}' as label",
+             f"from public.{name(rng)} -- {rng.choice(JAPANESE)}",
+             "where created_at > sysdate - 1;"]
+    return '\n'.join(lines)
+
+
+STATEMENTS = [(ddl, 4), (view, 2), (redash, 3), (listagg, 2), (long_line, 0.1), (japanese, 1)]
+
+
+def generate_corpus(corpus_dir, files, seed):
+    """Write `files` synthetic Redshift SQL files (about 5% in cp932) and return their paths."""
+    rng = random.Random(seed)
+    generators, weights = zip(*STATEMENTS)
+    paths = []
+    for i in range(files):
+        subdir = Path(corpus_dir, rng.choice(['tables', 'views', 'redash']))
+        subdir.mkdir(parents=True, exist_ok=True)
+        statements = rng.choices(generators, weights, k=rng.randint(1, 20))
+        sql = '\n\n'.join(statement(rng) for statement in statements) + '\n'
+        encoding = 'cp932' if rng.random() < 0.05 else 'utf-8'
+        path = subdir / f"public.{name(rng)}_{i:06d}.sql"
+        path.write_bytes(sql.encode(encoding))
+        paths.append(path)
+    return paths
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(paths, engine='regex', statements=False):
+    """Convert every file in memory and return throughput, peak RSS and per-file latency percentiles."""
+    lines = 0
+    size = 0
+    latencies = []
+    start = time.perf_counter()
+    for path in paths:
+        file_start = time.perf_counter()
+        source = path.read_bytes()
+        sql = decode_sql(source)
+        for _ in convert_lines(sql.splitlines(keepends=True), False, engine, str(path), statements):
+            pass
+        latencies.append(time.perf_counter() - file_start)
+        lines += sql.count('\n')
+        size += len(source)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    return {
+        'files': len(paths),
+        'lines': lines,
+        'mb': round(size / 1024 / 1024, 3),
+        'seconds': round(elapsed, 3),
+        'lines_per_sec': round(lines / elapsed, 1) if elapsed else None,
+        'mb_per_sec': round(size / 1024 / 1024 / elapsed, 3) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'latency_ms': {f'p{p}': round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 99, 100)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the SQL converter on a synthetic Redshift SQL corpus.')
+    parser.add_argument('--corpus', action='store', default="sql_converter/benchmark-sql",
+                        help='corpus directory, generated if it has no SQL files (default: "benchmark-sql")')
+    parser.add_argument('--files', action='store', type=int, default=500,
+                        help='number of files to generate (default: 500)')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='random seed of the generated corpus (default: 0)')
+    parser.add_argument('--engine', action='store', choices=['regex', 'tokenizer'], default='regex',
+                        help='conversion engine (default: "regex")')
+    parser.add_argument('--statements', action='store_true',
+                        help='convert statement by statement')
+    parser.add_argument('--output', action='store', default="sql_converter/benchmark.json",
+                        help='JSON file the results are appended to (default: "sql_converter/benchmark.json")')
+    args = parser.parse_args()
+
+    paths = sorted(Path(args.corpus).glob("**/*.sql"))
+    if not paths:
+        print(f"generating {args.files} files in {args.corpus}")
+        paths = generate_corpus(args.corpus, args.files, args.seed)
+    print(f"{len(paths)} files found.")
+
+    result = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'engine': args.engine,
+        'statements': args.statements,
+        'corpus': args.corpus,
+        **run_benchmark(paths, args.engine, args.statements),
+    }
+    for key, value in result.items():
+        print(f"{key:<16}{value}")
+
+    output = Path(args.output)
+    results = json.loads(output.read_text()) if output.exists() else []
+    results.append(result)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
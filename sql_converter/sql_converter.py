@@ -1,16 +1,38 @@
 def usage():
     print("""\
-# Usage: sql_converter.py [--inputdir {dir}] [--outputdir {dir}] [--no_comments]
+# Usage: sql_converter.py [--inputdir {dir}] [--outputdir {dir}] [--no_comments] [--jobs {n}] [--engine {regex|tokenizer}] [--cache_dir {dir} | --no_cache] [--profile [{json}]] [--statements] [--line_timeout {sec}] [--timeout_report {json}] [--watch [--interval {sec}]]
+#        [--cluster_by [--cluster_distkey] [--cluster_min_mb {mb} --table_sizes {csv}] [--cluster_report {json}]]
+#        sql_converter.py --stdin [--no_comments] [--engine {regex|tokenizer}] [--statements] [--line_timeout {sec}] < in.sql > out.sql
     """)
 
 
 import argparse
+import csv
+import hashlib
+import io
+import json
 import os
 import re
+import shutil
+import signal
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 
-from tqdm import tqdm
+if __package__:
+    # imported as sql_converter.sql_converter
+    from . import sql_tokenizer
+    from .sql_profiler import RuleProfiler
+    from .sql_tokenizer import lex, snow_token_lines, split_statements, table_keys
+else:
+    # run as a script from sql_converter/
+    import sql_tokenizer
+    from sql_profiler import RuleProfiler
+    from sql_tokenizer import lex, snow_token_lines, split_statements, table_keys
 
 ### General RegExes
 comment_line_re = re.compile('^\s*--.*$', re.IGNORECASE)
@@ -238,15 +260,37 @@ parse_json_re = re.compile('(.*)(parse_json)(.*)', re.IGNORECASE)
 
 json_re = re.compile('(.*)(JSON)(.*)', re.IGNORECASE)
 
+### Rule dispatch
+# Every rule below is only tried when its trigger keyword appears in the line.
+# A keyword must be a necessary condition for the rule's regex to match, so gating never changes the output.
+# Keep the list prefix-free (no keyword may start another one): the scan reports one keyword per position.
+rule_keywords = [
+    '+', '--', '.', 'alter', 'array', 'auto_increment', 'avg', 'binary', 'bpchar', 'ceiling', 'char', 'coalesce',
+    'create', 'date_add', 'date_diff', 'decimal', 'default', 'delete', 'distkey', 'diststyle', 'double', 'encode',
+    'float', 'grant', 'identity', 'index', 'int', 'jst', 'json', 'listagg', 'nchar', 'now', 'numeric', 'nvarchar',
+    'nvl', 'owner', 'pg_catalog', 'pgdate_part', 'set', 'similar', 'sortkey', 'sysdate', 'text', 'trunc',
+    'unbounded', 'unsigned', 'view',
+]
+# zero-width lookahead, so overlapping keywords (e.g. 'char' inside 'nvarchar') are all found in one pass
+rule_keyword_re = re.compile('(?=' + '|'.join(f'({re.escape(k)})' for k in rule_keywords) + ')', re.IGNORECASE)
+
+
+def scan_keywords(sql):
+    return {rule_keywords[m.lastindex - 1] for m in rule_keyword_re.finditer(sql)}
+
+
 # Convert source SQL to Snowflake SQL
 def make_snow(sqlin, sqlout, no_comments):
+    for converted in snow_lines(sqlin, no_comments, sqlin.name):
+        sqlout.write(converted)
+
+
+# Convert source SQL lines to Snowflake SQL, yielding the output of each line ('' if it was dropped)
+def snow_lines(sqlin, no_comments, filename):
     ### processing mode
     comment_lines = None
     term_re = None
 
-    # filename
-    filename = sqlin.name
-
     previous_line = None
 
     redash_overview = None
@@ -256,6 +300,17 @@ def make_snow(sqlin, sqlout, no_comments):
 
     multi_vi_ai_list = []
 
+    # keywords of the current line, rescanned only when a rule has rewritten it
+    scanned_sql = None
+    line_keywords = set()
+
+    def has_keyword(keyword):
+        nonlocal scanned_sql, line_keywords
+        if sql is not scanned_sql:
+            scanned_sql = sql
+            line_keywords = scan_keywords(sql)
+        return keyword in line_keywords
+
     for line in sqlin:
         ### state variables
         pre = None
@@ -272,13 +327,13 @@ def make_snow(sqlin, sqlout, no_comments):
         # if current line is already fully commented, don't bother with any matching
         result = comment_line_re.match(sql)
         if result:
-            write_line(sqlout, sql, comment)
+            yield format_line(sql, comment)
             continue
 
         # if current line is already all whitespace, don't bother with any matching
         result = whitespace_line_re.match(sql)
         if result:
-            write_line(sqlout, sql, comment)
+            yield format_line(sql, comment)
             continue
 
         # if we're commenting out multiple lines, check if this is the last
@@ -289,11 +344,11 @@ def make_snow(sqlin, sqlout, no_comments):
                 term_re = None
             comment = append_comment(comment, sql, no_comments)
             sql = None
-            write_line(sqlout, sql, comment)
+            yield format_line(sql, comment)
             continue
 
         # CHAR(n BYTE) => CHAR(n)
-        result = char_re.match(sql)
+        result = char_re.match(sql) if has_keyword('char') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)  # char clause
@@ -304,7 +359,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # DEFAULT SYSDATE => deleted (OK only because data loaded from table should already have date)
-        result = default_sysdate_re.match(sql)
+        result = default_sysdate_re.match(sql) if has_keyword('sysdate') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -313,7 +368,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # NVARCHAR => VARCHAR
-        result = nvarchar_re.match(sql)
+        result = nvarchar_re.match(sql) if has_keyword('nvarchar') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -322,7 +377,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # NCHAR => CHAR
-        result = nchar_re.match(sql)
+        result = nchar_re.match(sql) if has_keyword('nchar') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -331,7 +386,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # DATE_ADD => DATEADD
-        result = date_add_re.match(sql)
+        result = date_add_re.match(sql) if has_keyword('date_add') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -357,7 +412,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # DATE_DIFF => DATEDIFF
-        result = date_diff_re.match(sql)
+        result = date_diff_re.match(sql) if has_keyword('date_diff') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -365,7 +420,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, pre + clause, no_comments)
 
         # PGDATE_PART => DATE_PART
-        result = pgdate_part_re.match(sql)
+        result = pgdate_part_re.match(sql) if has_keyword('pgdate_part') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -373,7 +428,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, pre + clause, no_comments)
 
         # PG_CATALOG => ''
-        result = pg_catalog_re.match(sql)
+        result = pg_catalog_re.match(sql) if has_keyword('pg_catalog') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -381,7 +436,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, pre + clause, no_comments)
 
         # ceiling => ceil
-        result = ceiling_re.match(sql)
+        result = ceiling_re.match(sql) if has_keyword('ceiling') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -391,7 +446,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # now => CURRENT_TIMESTAMP()
-        result = now_re.match(sql)
+        result = now_re.match(sql) if has_keyword('now') else None
         if result:
             clause = result.group(2)
 
@@ -399,7 +454,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # delete ...; => delete from ...;
-        result = delete_re.match(sql)
+        result = delete_re.match(sql) if has_keyword('delete') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -409,11 +464,11 @@ def make_snow(sqlin, sqlout, no_comments):
 
         # min(survey_id) OVER(PARTITION BY panel_id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
         # => min(survey_id) OVER(PARTITION BY panel_id)
-        result = rows_unbounded_re.match(sql)
-        order_by_re = previous_order_by_re.match(sql)
+        result = rows_unbounded_re.match(sql) if has_keyword('unbounded') else None
+        order_by_re = previous_order_by_re.match(sql) if result else None
         # not commented out if order by.
         previous_order = None
-        if previous_line:
+        if result and previous_line:
             previous_order = previous_order_by_re.match(previous_line)
         if result and previous_order is None and order_by_re is None:
             pre = result.group(1)
@@ -422,7 +477,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, pre + clause, no_comments)
 
         # alter => ignore
-        result = alter_re.match(sql)
+        result = alter_re.match(sql) if has_keyword('alter') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -430,7 +485,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # owner => ignore
-        result = owner_re.match(sql)
+        result = owner_re.match(sql) if has_keyword('owner') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -438,7 +493,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # grant => ignore
-        result = grant_re.match(sql)
+        result = grant_re.match(sql) if has_keyword('grant') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -446,7 +501,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # FLOAT8 => FLOAT
-        result = floatN_re.match(sql)
+        result = floatN_re.match(sql) if has_keyword('float') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -455,7 +510,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # CREATE TABLE => CREATE OR REPLACE TABLE
-        result = createtable_re.match(sql)
+        result = createtable_re.match(sql) if has_keyword('create') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -464,7 +519,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # DISTKEY(col) => ignore
-        result = distkey_re.match(sql)
+        result = distkey_re.match(sql) if has_keyword('distkey') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -473,7 +528,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # SORTKEY => ignore through end of statement
-        result = sortkey_multiline_re.match(sql)
+        result = sortkey_multiline_re.match(sql) if has_keyword('sortkey') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -485,7 +540,7 @@ def make_snow(sqlin, sqlout, no_comments):
             term_re = statement_term_re
 
         # SORTKEY(col) => ignore
-        result = sortkey_re.match(sql)
+        result = sortkey_re.match(sql) if has_keyword('sortkey') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -494,7 +549,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # character set utf8 => ignore
-        result = charset_re.match(sql)
+        result = charset_re.match(sql) if has_keyword('char') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -503,7 +558,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # auto_increment => autoincrement
-        result = auto_increment_re.match(sql)
+        result = auto_increment_re.match(sql) if has_keyword('auto_increment') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -512,7 +567,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # unsigned => ignore
-        result = unsigned_re.match(sql)
+        result = unsigned_re.match(sql) if has_keyword('unsigned') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -521,7 +576,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # default '0' => default 0
-        result = default_zero_re.match(sql)
+        result = default_zero_re.match(sql) if has_keyword('default') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -530,7 +585,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # default '0000-00-00' => default '0000-00-00'::date
-        result = default_zero_date_re.match(sql)
+        result = default_zero_date_re.match(sql) if has_keyword('default') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -539,7 +594,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # default '0000-00-00 00:00:00' => default '0000-00-00 00:00:00'::timestamp
-        result = default_zero_ts_re.match(sql)
+        result = default_zero_ts_re.match(sql) if has_keyword('default') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -548,7 +603,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # binary default => binary ignore default
-        result = binary_default_re.match(sql)
+        result = binary_default_re.match(sql) if has_keyword('binary') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -557,7 +612,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # decimal(n>38,m) => decimal(38,m)
-        result = decimal_re.match(sql)
+        result = decimal_re.match(sql) if has_keyword('decimal') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -570,7 +625,7 @@ def make_snow(sqlin, sqlout, no_comments):
                 comment = append_comment(comment, clause, no_comments)
 
         # float|double(n,m) => float|double
-        result = float_double_re.match(sql)
+        result = float_double_re.match(sql) if (has_keyword('float') or has_keyword('double')) else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -580,7 +635,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # longtext => string
-        result = text_types_re.match(sql)
+        result = text_types_re.match(sql) if has_keyword('text') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -589,7 +644,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # SET ... = ; => ignore
-        result = uncommented_set_re.match(sql)
+        result = uncommented_set_re.match(sql) if has_keyword('set') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -599,7 +654,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, str, no_comments)
 
         # ENCODE type => ignore
-        result = encode_re.match(sql)
+        result = encode_re.match(sql) if has_keyword('encode') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -608,7 +663,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # DISTSTYLE type => ignore
-        result = diststyle_re.match(sql)
+        result = diststyle_re.match(sql) if has_keyword('diststyle') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -617,7 +672,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # SORTKEY type => ignore
-        result = sortkeystile_re.match(sql)
+        result = sortkeystile_re.match(sql) if has_keyword('sortkey') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -626,7 +681,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause + post, no_comments)
 
         # 'now'::(character varying|text) => current_timestamp
-        result = now_character_varying_re.match(sql)
+        result = now_character_varying_re.match(sql) if has_keyword('now') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -635,7 +690,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # bpchar => char
-        result = bpchar_re.match(sql)
+        result = bpchar_re.match(sql) if has_keyword('bpchar') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -644,7 +699,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # character varying => varchar
-        result = character_varying_re.match(sql)
+        result = character_varying_re.match(sql) if has_keyword('char') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -653,7 +708,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # interleaved => ignore
-        result = interleaved_re.match(sql)
+        result = interleaved_re.match(sql) if has_keyword('int') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -662,7 +717,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # redshift identity syntax => identity
-        result = identity_re.match(sql)
+        result = identity_re.match(sql) if has_keyword('identity') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -670,7 +725,7 @@ def make_snow(sqlin, sqlout, no_comments):
             sql = '{0} IDENTITY({1},1) {2}'.format(pre, clause, post)
 
         # redshift date trunc syntax => date_trunc
-        result = trunc_re.match(sql)
+        result = trunc_re.match(sql) if has_keyword('trunc') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -679,7 +734,7 @@ def make_snow(sqlin, sqlout, no_comments):
             sql = '{0}DATE_TRUNC(\'DAY\', {1}) {2}'.format(pre, timespec, post)
             comment = append_comment(comment, clause, no_comments)
 
-        result = int_re.match(sql)
+        result = int_re.match(sql) if has_keyword('int') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -688,7 +743,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # integer or bigint => numeric(18,0)
-        result = integer_re.match(sql) or bigint_re.match(sql)
+        result = (integer_re.match(sql) or bigint_re.match(sql)) if has_keyword('int') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -701,7 +756,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # numeric(x,y>0) => double
-        result = numeric_re.match(sql)
+        result = numeric_re.match(sql) if has_keyword('numeric') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -712,7 +767,7 @@ def make_snow(sqlin, sqlout, no_comments):
                 comment = append_comment(comment, pre + clause, no_comments)
 
         # array[] => []
-        result = array_re.match(sql)
+        result = array_re.match(sql) if has_keyword('array') else None
         if result:
             _result = line.rstrip().replace('`', '')
             __result = array_parse_re.match(_result)
@@ -725,7 +780,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, f"{_result}", no_comments)
 
         # + => ||
-        result = string_plus_re.match(sql)
+        result = string_plus_re.match(sql) if has_keyword('+') else None
         if result:
 
             _single_double_quote = string_plus_quote_re.match(sql)
@@ -800,9 +855,9 @@ def make_snow(sqlin, sqlout, no_comments):
                             comment = append_comment(comment, f"{pre}{clause}{post}", no_comments)
 
         # schema
-        result = schema_re.match(sql)
+        result = schema_re.match(sql) if filename and has_keyword('view') else None
         # create temp was also covered, so it was excluded.
-        temp_result = schema_temp_re.match(sql)
+        temp_result = schema_temp_re.match(sql) if result else None
         if result and temp_result is None:
             __clause = result.group(2)
             _clause = __clause.split()
@@ -815,7 +870,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, pre, no_comments)
 
         # lower => upper
-        if redash_overview is None:
+        if redash_overview is None and has_keyword('.'):
             result = lowercase_shema_re.match(sql)
             check_result = lowercase_sub_shema_re.match(sql)
             check_order_by = previous_order_by_re.match(sql)
@@ -914,7 +969,7 @@ def make_snow(sqlin, sqlout, no_comments):
                                              no_comments)
 
         # similar to => regexp_like
-        result = similar_to_re.match(sql)
+        result = similar_to_re.match(sql) if has_keyword('similar') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -926,16 +981,16 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, result.group(3) + ' %', no_comments)
 
         # jst => japan
-        result = jst_re.match(sql)
+        result = jst_re.match(sql) if has_keyword('jst') else None
         if result:
             sql = result.group().replace('JST', 'Japan')
             comment = append_comment(comment, result.group(2).replace('JST', 'Japan'), no_comments)
 
         # AVG() => TRUNC(AVG())
-        result = avg_re.match(sql)
+        result = avg_re.match(sql) if has_keyword('avg') else None
         # avg pattern is excluded.
-        avg_exclusion = avg_exclusion_re.match(sql)
-        ai_vi_denial = denial_ai_vi_re.match(sql)
+        avg_exclusion = avg_exclusion_re.match(sql) if result else None
+        ai_vi_denial = denial_ai_vi_re.match(sql) if result else None
         if result and avg_exclusion is not None and ai_vi_denial is None:
             sql = f"{result.group(1)}TRUNC({result.group(2)}{result.group(3)}){result.group(4)}"
             comment = append_comment(comment, result.group(2), no_comments)
@@ -960,7 +1015,7 @@ def make_snow(sqlin, sqlout, no_comments):
         # listagg(DISTINCT name, '/') WITHIN GROUP (ORDER BY id DESC)
         # => list_distinct(listagg(name, '/') WITHIN GROUP (ORDER BY id DESC),'/')
 
-        result = new_listagg_distinct_re.match(sql)
+        result = new_listagg_distinct_re.match(sql) if has_keyword('listagg') else None
         if result:
 
             __column = new_listagg_column_re.match(result.group(5))
@@ -982,7 +1037,7 @@ def make_snow(sqlin, sqlout, no_comments):
                 comment = append_comment(comment, "warning: no within group order by, write it down.", no_comments)
 
         # INDEX CREATION => ignore through end of statement
-        result = index_re.match(sql)
+        result = index_re.match(sql) if has_keyword('index') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -992,11 +1047,11 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, str, no_comments)
             comment_lines = 1
             term_re = statement_term_re
-            write_line(sqlout, sql, comment)
+            yield format_line(sql, comment)
             continue
 
         # ALTER TABLE ... ADD PRIMARY KEY => ignore
-        result = pk_re.match(sql)
+        result = pk_re.match(sql) if has_keyword('alter') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -1008,7 +1063,7 @@ def make_snow(sqlin, sqlout, no_comments):
             term_re = statement_term_re
 
         # SET ... TO => ignore
-        result = set_re.match(sql)
+        result = set_re.match(sql) if has_keyword('set') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -1020,7 +1075,7 @@ def make_snow(sqlin, sqlout, no_comments):
             term_re = statement_term_re
 
         # coalesce(col1) => coalesce(col1,null)
-        result = coalesce_re.match(sql)
+        result = coalesce_re.match(sql) if has_keyword('coalesce') else None
         if result:
             pre = result.group(2)
             clause = result.group(3)
@@ -1031,7 +1086,7 @@ def make_snow(sqlin, sqlout, no_comments):
                 comment = append_comment(comment, pre + clause, no_comments)
 
         # nvl(col1) => nvl(col1,null)
-        result = nvl_re.match(sql)
+        result = nvl_re.match(sql) if has_keyword('nvl') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -1047,7 +1102,7 @@ def make_snow(sqlin, sqlout, no_comments):
                         comment = append_comment(comment, clause + post, no_comments)
 
         # json_extract_array_element_text => parse_json
-        result = json_extract_array_element_text_re.match(sql)
+        result = json_extract_array_element_text_re.match(sql) if has_keyword('json') else None
         if result:
             clause = result.group(2)
             post = result.group(3)
@@ -1060,8 +1115,8 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause + _original, no_comments)
 
         # json => variant
-        check_result = parse_json_re.match(sql)
-        result = json_re.match(sql)
+        result = json_re.match(sql) if has_keyword('json') else None
+        check_result = parse_json_re.match(sql) if result else None
         if not check_result and result:
             pre = result.group(1)
             clause = result.group(2)
@@ -1070,7 +1125,7 @@ def make_snow(sqlin, sqlout, no_comments):
             comment = append_comment(comment, clause, no_comments)
 
         # Empty Comma => ignore
-        result = empty_comma_re.match(sql)
+        result = empty_comma_re.match(sql) if has_keyword('--') else None
         if result:
             pre = result.group(1)
             clause = result.group(2)
@@ -1091,7 +1146,7 @@ def make_snow(sqlin, sqlout, no_comments):
 
             # determine prior period
             # e.g. trunc(sysdate,'MM')-1
-            result = prior_period_re.match(sql)
+            result = prior_period_re.match(sql) if has_keyword('trunc') else None
             if result:
                 pre = result.group(1)
                 clause = result.group(2)
@@ -1104,14 +1159,14 @@ def make_snow(sqlin, sqlout, no_comments):
                 dml_repeat = True
 
             # sysdate => sysdate()
-            result = sysdate_ignore_re.match(sql)
+            result = sysdate_ignore_re.match(sql) if has_keyword('sysdate') else None
             if result:
                 clause = result.group(2)
                 sql = f"{clause}()"
                 comment = append_comment(comment, clause, no_comments)
 
             # SYSDATE => CURRENT_TIMESTAMP()
-            result = sysdate_re.match(sql)
+            result = sysdate_re.match(sql) if has_keyword('sysdate') else None
             if result:
                 pre = result.group(1)
                 clause = result.group(2)
@@ -1130,7 +1185,7 @@ def make_snow(sqlin, sqlout, no_comments):
             result = comma_line_re.match(sql)
             if result:
                 sql = None  # the mods have reduced this line to a single vestigial comma
-        write_line(sqlout, sql, comment)
+        yield format_line(sql, comment)
         continue
 
 
@@ -1144,18 +1199,402 @@ def append_comment(old_comment, new_comment, no_comments):
     return old_comment
 
 
-def write_line(sqlout, sql, comment):
+def format_line(sql, comment):
+    out = ''
     if sql is not None:
-        sqlout.write(sql)
+        out += sql
     if comment:
         # owner and grant and create temp => ignore
         if not (owner_re.match(comment) or grant_re.match(comment) or schema_temp_re.match(comment)):
             if comment.rstrip()[-1] == ';':
-                sqlout.write(';')
-        sqlout.write('\t\t--// {0}'.format(comment))
+                out += ';'
+        out += '\t\t--// {0}'.format(comment)
     if sql is not None or comment:
-        sqlout.write('\n')
-    return
+        out += '\n'
+    return out
+
+
+def snow_statements(convert, sqlin, no_comments, filename):
+    """Convert complete statements one at a time, each with fresh rule state.
+
+    Multi-line state (lines commented out up to the end of a statement, the previous line of ROWS
+    UNBOUNDED) never leaks from one statement into the next, and a statement repeated in the input
+    (e.g. the same GRANT for many users) is converted once.
+    """
+    converted_statements = {}
+    for statement in split_statements(sqlin):
+        key = ''.join(statement)
+        if key not in converted_statements:
+            converted_statements[key] = list(convert(statement, no_comments, filename))
+        yield from converted_statements[key]
+
+
+class LineTimeout(Exception):
+    pass
+
+
+def raise_line_timeout(signum, frame):
+    raise LineTimeout()
+
+
+def snow_lines_with_timeout(convert, sqlin, no_comments, filename, line_timeout, skipped):
+    """Convert like `convert`, giving up on any line that takes longer than `line_timeout` seconds.
+
+    A regex cannot be stopped from another thread, but sre checks for signals while it backtracks, so
+    SIGALRM raises LineTimeout in the middle of the match. The line is written unchanged with a marker and
+    appended to `skipped`, and conversion restarts with fresh rule state on the next line. Without SIGALRM
+    (Windows) or outside the main thread, lines are converted without a budget.
+    """
+    if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield from convert(sqlin, no_comments, filename)
+        return
+
+    lines = iter(sqlin)
+    line = None
+
+    def timed_lines():
+        nonlocal line
+        for line in lines:
+            signal.setitimer(signal.ITIMER_REAL, line_timeout)
+            yield line
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_line_timeout)
+    try:
+        while True:
+            try:
+                for converted in convert(timed_lines(), no_comments, filename):
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                    yield converted
+                return
+            except LineTimeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                skipped.append({'file': filename, 'sql': line.rstrip()[:200]})
+                yield f"{line.rstrip()}\t\t--// conversion skipped: timeout\n"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+# Snowflake recommends at most 3 or 4 clustering keys; the leading sort key columns matter most
+CLUSTER_MAX_COLUMNS = 4
+
+
+def table_size(table, sizes):
+    """Size in MB of a table from the --table_sizes CSV, matched with or without its schema."""
+    table = table.replace('"', '').lower()
+    size = sizes.get(table)
+    if size is None and '.' not in table:
+        size = next((size for name, size in sizes.items() if name.rsplit('.', 1)[-1] == table), None)
+    return size
+
+
+def cluster_columns(keys, clustering):
+    """CLUSTER BY columns for the keys of a CREATE TABLE, or no columns and why the keys are dropped instead."""
+    if keys['temporary']:
+        return [], 'temporary table'
+    if keys['ctas']:
+        return [], 'CREATE TABLE AS'
+    columns = list(keys['sortkey']) if keys['sort_style'] == 'compound' else []
+    if clustering.get('distkey'):
+        columns += [column for column in keys['distkey'] if column not in columns]
+    if not columns:
+        return [], f"{keys['sort_style']} sort key" if keys['sort_style'] else 'no sort key'
+    min_mb = clustering.get('min_mb')
+    if min_mb:
+        size = table_size(keys['table'], clustering.get('sizes', {}))
+        if size is None:
+            return [], 'size unknown'
+        if size < min_mb:
+            return [], f'smaller than {min_mb:g} MB'
+    return columns[:CLUSTER_MAX_COLUMNS], None
+
+
+def drop_sort_key_residue(output, no_comments):
+    """Remove what the converter left of a `COMPOUND|INTERLEAVED SORTKEY (...)` clause from a converted CREATE TABLE.
+
+    The regex engine drops SORTKEY (...) but keeps the COMPOUND or INTERLEAVED in front of it, and when the
+    column list starts on the next line, the list too. Neither word is Snowflake syntax, so outside the column
+    definitions they and a column list right after them are moved into the comment.
+    """
+    depth = 0
+    open_kind = None
+    # 'word' after COMPOUND / INTERLEAVED, 'list' inside its column list
+    residue = None
+    list_depth = 0
+    for i, line in enumerate(output):
+        sql, tab, comment = line.rstrip('\n').partition('\t\t--// ')
+        tokens, open_kind = lex(sql, open_kind)
+        dropped = []
+        for token in tokens:
+            if token.kind in ('ws', 'comment', 'block_comment', 'string') and residue != 'list':
+                if token.kind == 'ws' and residue == 'word':
+                    dropped.append(token.text)
+                    token.text = ''
+                continue
+            if residue == 'list':
+                list_depth += {'(': 1, ')': -1}.get(token.text, 0) if token.kind == 'op' else 0
+                residue = 'list' if list_depth > 0 else None
+            elif depth == 0 and token.kind == 'word' and token.value in ('COMPOUND', 'INTERLEAVED'):
+                residue = 'word'
+            elif residue == 'word' and token.kind == 'op' and token.text == '(':
+                residue, list_depth = 'list', 1
+            else:
+                residue = None
+                if token.kind == 'op' and token.text in ('(', ')'):
+                    depth += 1 if token.text == '(' else -1
+                continue
+            dropped.append(token.text)
+            token.text = ''
+        if not ''.join(dropped).strip():
+            continue
+        comments = [c for c in (comment, ''.join(dropped).strip()) if c and not no_comments]
+        sql = ''.join(token.text for token in tokens).rstrip()
+        output[i] = sql_tokenizer.format_line(sql if sql.strip() else None, ' // '.join(comments) or None)
+    return output
+
+
+def add_cluster_by(output, columns):
+    """Insert CLUSTER BY before the `;` ending the converted statement (or after its last line)."""
+    cluster_by = f"CLUSTER BY ({', '.join(columns)})"
+    for i in reversed(range(len(output))):
+        sql, tab, comment = output[i].partition('\t\t--// ')
+        tokens = lex(sql)[0]
+        ends = [j for j, token in enumerate(tokens) if token.kind == 'op' and token.text == ';']
+        if ends:
+            # the regex engine writes `;;` when the source `;` went into a comment: keep one of them
+            end = ends.pop()
+            while ends and all(token.kind == 'ws' for token in tokens[ends[-1] + 1:end]):
+                for token in tokens[ends[-1] + 1:end + 1]:
+                    token.text = ''
+                end = ends.pop()
+            sql = ''.join(token.text for token in tokens)
+            pos = sum(len(token.text) for token in tokens[:end])
+            output[i] = f"{' '.join(filter(None, [sql[:pos].rstrip(), cluster_by]))}{sql[pos:]}{tab}{comment}"
+            return output
+    return output + [f"{cluster_by}\n"]
+
+
+def snow_clustered(convert, sqlin, no_comments, filename, clustering, tables):
+    """Convert like `convert`, turning SORTKEY (and with clustering['distkey'] DISTKEY) into CLUSTER BY.
+
+    Both engines yield exactly one output per source line, so the output of each statement is collected
+    and CLUSTER BY is added to CREATE TABLE statements from the keys of their source. Every table with
+    dist or sort keys is appended to `tables` with the keys that were kept and dropped.
+    """
+    source_statements = deque()
+
+    def statement_lines():
+        for statement in split_statements(sqlin):
+            source_statements.append(statement)
+            yield from statement
+
+    output = []
+    for converted in convert(statement_lines(), no_comments, filename):
+        output.append(converted)
+        if len(output) < len(source_statements[0]):
+            continue
+        keys = table_keys(source_statements.popleft())
+        if keys and (keys['sortkey'] or keys['distkey'] or keys['sort_style']):
+            columns, reason = cluster_columns(keys, clustering)
+            output = drop_sort_key_residue(output, no_comments)
+            if columns:
+                output = add_cluster_by(output, columns)
+            tables.append({
+                'file': filename,
+                'table': keys['table'],
+                'diststyle': keys['diststyle'],
+                'distkey': keys['distkey'],
+                'sort_style': keys['sort_style'],
+                'sortkey': keys['sortkey'],
+                'cluster_by': columns,
+                'dropped': [key for key in keys['sortkey'] + keys['distkey'] if key not in columns],
+                'reason': reason,
+            })
+        yield from output
+        output = []
+    yield from output
+
+
+def convert_lines(lines, no_comments=False, engine='regex', filename=None, statements=False, line_timeout=None,
+                  skipped=None, clustering=None, tables=None):
+    """Convert Redshift SQL lines to Snowflake SQL, yielding each converted line as soon as it is ready.
+
+    `lines` is any iterable of lines (a file, sys.stdin, a list). `filename` (schema.name.sql) is only used
+    to add the schema to CREATE VIEW; without it views are left as they are. With `statements` the input
+    is converted statement by statement (see snow_statements()), and lines are yielded per statement.
+    With `line_timeout` (seconds) a line taking longer is passed through (see snow_lines_with_timeout())
+    and recorded in the `skipped` list. With `clustering` ({'distkey': bool, 'min_mb': float, 'sizes':
+    {table: MB}}) sort keys become CLUSTER BY (see snow_clustered()) and tables are recorded in `tables`.
+    """
+    convert = snow_token_lines if engine == 'tokenizer' else snow_lines
+    if line_timeout:
+        convert = partial(snow_lines_with_timeout, convert, line_timeout=line_timeout,
+                          skipped=[] if skipped is None else skipped)
+    if statements:
+        convert = partial(snow_statements, convert)
+    if clustering is not None:
+        convert = partial(snow_clustered, convert, clustering=clustering, tables=[] if tables is None else tables)
+    for converted in convert(lines, no_comments, filename):
+        if converted:
+            yield converted
+
+
+def convert_string(sql, no_comments=False, engine='regex', filename=None, statements=False, line_timeout=None,
+                   skipped=None, clustering=None, tables=None):
+    """Convert Redshift SQL text to Snowflake SQL text."""
+    return ''.join(convert_lines(sql.splitlines(keepends=True), no_comments, engine, filename, statements,
+                                 line_timeout, skipped, clustering, tables))
+
+
+@lru_cache(maxsize=None)
+def conversion_fingerprint(no_comments, engine, statements=False):
+    """Version of the conversion: any change to the rules or the options invalidates cached conversions."""
+    digest = hashlib.sha256(f'{no_comments=} {engine=} {statements=}'.encode())
+    for source in (Path(__file__), Path(__file__).with_name('sql_tokenizer.py')):
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def decode_sql(source):
+    """Decode the bytes of a source file: utf-8, or sjis(cp932) if it is not valid utf-8."""
+    try:
+        return source.decode('utf-8')
+    except UnicodeDecodeError:
+        return source.decode('cp932')
+
+
+def cache_path(cache_dir, src_sql_path, source, no_comments, engine, statements=False, clustering=None):
+    digest = hashlib.sha256(conversion_fingerprint(no_comments, engine, statements).encode())
+    if clustering is not None:
+        digest.update(json.dumps(clustering, sort_keys=True).encode())
+    # the file name is only used by the CREATE VIEW schema rule, so other files are shared across names
+    if re.search('view', source.decode('utf-8', 'replace'), re.IGNORECASE):
+        digest.update(str(src_sql_path).encode())
+    digest.update(source)
+    key = digest.hexdigest()
+    return Path(cache_dir, key[:2], f'{key}.sql')
+
+
+def convert_file(src_sql_path, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments, engine='regex',
+                 cache_dir=None, profiler=None, statements=False, line_timeout=None, clustering=None):
+    """Convert one file and return its report: the lines skipped by the line timeout and, with clustering,
+    the tables with their dist and sort keys."""
+    snowflake_sql_subdir = snowflake_sql_dir_path / Path(src_sql_path.parts[-2])
+    if snowflake_sql_subdir.name != redshift_sql_dir_path.name:
+      os.makedirs(snowflake_sql_subdir, exist_ok=True)
+
+    dest_sql_path = snowflake_sql_dir_path / src_sql_path.name
+    source = src_sql_path.read_bytes()
+    cached_sql_path = cache_path(cache_dir, src_sql_path, source, no_comments, engine, statements,
+                                 clustering) if cache_dir else None
+    report = {'skipped': [], 'tables': []}
+    if cached_sql_path and cached_sql_path.exists():
+        shutil.copyfile(cached_sql_path, dest_sql_path)
+        if clustering is not None:
+            tables = json.loads(cached_sql_path.with_suffix('.json').read_text())
+            report['tables'] = [{**table, 'file': str(src_sql_path)} for table in tables]
+        print(f"cached {src_sql_path=}", file=sys.stderr)
+        return report
+
+    src_sql_lines = io.StringIO(decode_sql(source), newline=None)
+    if profiler:
+        src_sql_lines = profiler.wrap(src_sql_lines, str(src_sql_path))
+    snowflake_sql = ''.join(convert_lines(src_sql_lines, no_comments, engine, str(src_sql_path), statements,
+                                          line_timeout, report['skipped'], clustering, report['tables']))
+    with open(dest_sql_path, mode='w') as dest_sql_file:
+        dest_sql_file.write(snowflake_sql)
+
+    # a timeout depends on the machine and its load, so only complete conversions are cached
+    if cached_sql_path and not report['skipped']:
+        # write then rename, so --jobs workers never see a partial cache entry (the table report goes first)
+        os.makedirs(cached_sql_path.parent, exist_ok=True)
+        tmp_sql_path = cached_sql_path.with_name(f'{cached_sql_path.name}.{os.getpid()}.tmp')
+        if clustering is not None:
+            with open(tmp_sql_path, mode='w') as tmp_sql_file:
+                json.dump(report['tables'], tmp_sql_file)
+            os.replace(tmp_sql_path, cached_sql_path.with_suffix('.json'))
+        with open(tmp_sql_path, mode='w') as tmp_sql_file:
+            tmp_sql_file.write(snowflake_sql)
+        os.replace(tmp_sql_path, cached_sql_path)
+    print(f"done converting {src_sql_path=}", file=sys.stderr)
+    return report
+
+
+def convert_files(src_sql_paths, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments, engine='regex',
+                  cache_dir=None, statements=False, line_timeout=None, clustering=None):
+    """Worker for --jobs: convert the files in order and return errors instead of raising, and their reports."""
+    errors = []
+    report = {'skipped': [], 'tables': []}
+    for src_sql_path in src_sql_paths:
+        try:
+            file_report = convert_file(src_sql_path, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments,
+                                       engine, cache_dir, statements=statements, line_timeout=line_timeout,
+                                       clustering=clustering)
+        except Exception as e:
+            errors.append(f"{src_sql_path}: {type(e).__name__}: {e}")
+            continue
+        for key, entries in file_report.items():
+            report[key] += entries
+    return errors, report
+
+
+def watch(redshift_sql_dir_path, snowflake_sql_dir_path, no_comments, engine='regex', cache_dir=None,
+          statements=False, line_timeout=None, clustering=None, interval=0.5):
+    """Poll the input directory and convert the files added or modified since the previous scan, until interrupted.
+
+    The first scan converts every file (unchanged ones come from the cache). A file is modified when its
+    mtime or size changed; deleted files are left in the output directory.
+    """
+    seen = {}
+    while True:
+        scanned = {}
+        for src_sql_path in redshift_sql_dir_path.glob("**/*.sql"):
+            try:
+                stat = src_sql_path.stat()
+            except FileNotFoundError:
+                continue  # deleted while scanning
+            scanned[src_sql_path] = (stat.st_mtime_ns, stat.st_size)
+            if seen.get(src_sql_path) == scanned[src_sql_path]:
+                continue
+            try:
+                report = convert_file(src_sql_path, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments,
+                                      engine, cache_dir, statements=statements, line_timeout=line_timeout,
+                                      clustering=clustering)
+            except Exception as e:
+                print(f"[ERROR] {src_sql_path}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            for entry in report['skipped']:
+                print(f"[WARN] conversion skipped: timeout {entry['file']}: {entry['sql'][:80]}", file=sys.stderr)
+        seen = scanned
+        time.sleep(interval)
+
+
+def write_timeout_report(path, skipped):
+    with open(path, 'w') as f:
+        json.dump(skipped, f, indent=2, ensure_ascii=False)
+    for entry in skipped:
+        print(f"[WARN] conversion skipped: timeout {entry['file']}: {entry['sql'][:80]}", file=sys.stderr)
+    print(f"{len(skipped)} lines skipped by the line timeout, written to {path}", file=sys.stderr)
+
+
+def load_table_sizes(path):
+    """{table: MB} from a CSV of table name and size in MB (e.g. "schema"."table" and size of svv_table_info)."""
+    sizes = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                sizes[row[0].replace('"', '').strip().lower()] = float(row[1])
+            except (IndexError, ValueError):
+                continue  # header or blank line
+    return sizes
+
+
+def write_cluster_report(path, tables):
+    with open(path, 'w') as f:
+        json.dump(tables, f, indent=2, ensure_ascii=False)
+    clustered = sum(1 for table in tables if table['cluster_by'])
+    print(f"{clustered} of {len(tables)} tables with dist or sort keys clustered, report written to {path}",
+          file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -1166,31 +1605,135 @@ if __name__ == "__main__":
                         help='input SQL file directory in Redshift dialect (default: "redshift-sql")')
     parser.add_argument('--outputdir', action='store', default="sql_converter/snowflake-sql",
                         help='output SQL file directory in Snowflake dialect (default: "snowflake-sql")')
+    parser.add_argument('--jobs', action='store', type=int, default=1,
+                        help='number of worker processes converting files in parallel (default: 1)')
+    parser.add_argument('--engine', action='store', choices=['regex', 'tokenizer'], default='regex',
+                        help='conversion engine; "tokenizer" stays linear in the line length on long lines '
+                             '(default: "regex")')
+    parser.add_argument('--cache_dir', action='store', default="sql_converter/.cache",
+                        help='directory of converted files keyed by source content, reused on later runs '
+                             '(default: "sql_converter/.cache")')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='convert every file without reading or writing the cache')
+    parser.add_argument('--profile', action='store', nargs='?', const="sql_converter/profile.json",
+                        help='record match counts and timings of every rule and the slowest lines, and write them '
+                             'to a JSON file (default: "sql_converter/profile.json"); runs serially without cache')
+    parser.add_argument('--statements', action='store_true',
+                        help='convert statement by statement, so no rule state is carried from one statement '
+                             'into the next and repeated statements are converted once')
+    parser.add_argument('--line_timeout', action='store', type=float,
+                        help='seconds a line may take; slower lines are written unchanged with a '
+                             '"--// conversion skipped: timeout" marker (default: no limit)')
+    parser.add_argument('--timeout_report', action='store', default="sql_converter/timeouts.json",
+                        help='JSON file listing the lines skipped by --line_timeout '
+                             '(default: "sql_converter/timeouts.json")')
+    parser.add_argument('--cluster_by', action='store_true',
+                        help='turn compound SORTKEY columns into CLUSTER BY on CREATE TABLE instead of dropping them')
+    parser.add_argument('--cluster_distkey', action='store_true',
+                        help='with --cluster_by, also cluster by the DISTKEY column')
+    parser.add_argument('--cluster_min_mb', action='store', type=float, default=0,
+                        help='with --cluster_by, only cluster tables of at least this size in --table_sizes '
+                             '(default: 0, every table)')
+    parser.add_argument('--table_sizes', action='store',
+                        help='CSV of table name and size in MB used by --cluster_min_mb')
+    parser.add_argument('--cluster_report', action='store', default="sql_converter/cluster_report.json",
+                        help='JSON file listing, per table, the dist and sort keys kept as CLUSTER BY or dropped '
+                             '(default: "sql_converter/cluster_report.json")')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and convert files in --inputdir as they are added or modified')
+    parser.add_argument('--interval', action='store', type=float, default=0.5,
+                        help='seconds between scans of --inputdir in --watch mode (default: 0.5)')
+    parser.add_argument('--stdin', action='store_true',
+                        help='convert SQL read from stdin and write it to stdout instead of converting --inputdir')
     args = parser.parse_args()
+    clustering = None
+    if args.cluster_by:
+        clustering = {
+            'distkey': args.cluster_distkey,
+            'min_mb': args.cluster_min_mb,
+            'sizes': load_table_sizes(args.table_sizes) if args.table_sizes else {},
+        }
+    if args.stdin:
+        report = {'skipped': [], 'tables': []}
+        sys.stdout.writelines(convert_lines(sys.stdin, args.no_comments, args.engine, statements=args.statements,
+                                            line_timeout=args.line_timeout, skipped=report['skipped'],
+                                            clustering=clustering, tables=report['tables']))
+        if report['skipped']:
+            write_timeout_report(args.timeout_report, report['skipped'])
+        if clustering is not None:
+            write_cluster_report(args.cluster_report, report['tables'])
+        sys.exit()
+
     print(f'=============={args.inputdir=}')
     redshift_sql_dir_path: Path = Path(args.inputdir)
     print(f'=============={args.outputdir=}')
     snowflake_sql_dir_path: Path = Path(args.outputdir)
+    if args.watch:
+        print(f"watching {redshift_sql_dir_path} (Ctrl+C to stop)")
+        os.makedirs(snowflake_sql_dir_path, exist_ok=True)
+        try:
+            watch(redshift_sql_dir_path, snowflake_sql_dir_path, args.no_comments, args.engine,
+                  None if args.no_cache else args.cache_dir, args.statements, args.line_timeout, clustering,
+                  args.interval)
+        except KeyboardInterrupt:
+            sys.exit()
+
+    from tqdm import tqdm
     src_sql_files = list(redshift_sql_dir_path.glob("**/*.sql"))
     if not src_sql_files:
         print("[WARN] No files found.")
         exit()
     print(f"{len(src_sql_files)} files found.")
 
-    for src_sql_path in tqdm(src_sql_files, desc="Converting sql to snowflake style"):
-        snowflake_sql_subdir = snowflake_sql_dir_path / Path(src_sql_path.parts[-2])
-        if snowflake_sql_subdir.name != redshift_sql_dir_path.name:
-          os.makedirs(snowflake_sql_subdir, exist_ok=True)
-
-        # sjis(cp932) or utf-8
-        try:
-            with open(src_sql_path) as f:
-                ENCODING = 'utf-8'
-        except UnicodeDecodeError as e:
-            ENCODING = 'sjis'
-
-        no_comments: bool = args.no_comments
-        with open(src_sql_path, encoding=ENCODING) as src_sql_file, \
-            open(str(snowflake_sql_dir_path / src_sql_path.name), mode='w') as dest_sql_file:
-            make_snow(src_sql_file, dest_sql_file, no_comments)
-        print(f"done converting {src_sql_path=}", file=sys.stderr)
+    no_comments: bool = args.no_comments
+    cache_dir = None if args.no_cache or args.profile else args.cache_dir
+    os.makedirs(snowflake_sql_dir_path, exist_ok=True)
+    errors = []
+    report = {'skipped': [], 'tables': []}
+
+    def add_report(file_report):
+        for key, entries in file_report.items():
+            report[key] += entries
+
+    if args.profile:
+        profiler = RuleProfiler(statements=args.statements or args.cluster_by)
+        profiler.install(globals())
+        profiler.install_token_rules(sql_tokenizer)
+        for src_sql_path in tqdm(src_sql_files, desc="Converting sql to snowflake style"):
+            add_report(convert_file(src_sql_path, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments,
+                                    args.engine, profiler=profiler, statements=args.statements,
+                                    line_timeout=args.line_timeout, clustering=clustering))
+        profiler.uninstall()
+        profiler.write_report(args.profile)
+    elif args.jobs <= 1:
+        for src_sql_path in tqdm(src_sql_files, desc="Converting sql to snowflake style"):
+            add_report(convert_file(src_sql_path, redshift_sql_dir_path, snowflake_sql_dir_path, no_comments,
+                                    args.engine, cache_dir, statements=args.statements,
+                                    line_timeout=args.line_timeout, clustering=clustering))
+    else:
+        # files sharing an output file name go to the same worker in glob order,
+        # so the file that ends up in the output directory is the same as in a serial run
+        file_groups = {}
+        for src_sql_path in src_sql_files:
+            file_groups.setdefault(src_sql_path.name, []).append(src_sql_path)
+
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            worker = partial(convert_files, redshift_sql_dir_path=redshift_sql_dir_path,
+                             snowflake_sql_dir_path=snowflake_sql_dir_path, no_comments=no_comments, engine=args.engine,
+                             cache_dir=cache_dir, statements=args.statements, line_timeout=args.line_timeout,
+                             clustering=clustering)
+            chunksize = max(1, len(file_groups) // (args.jobs * 4))
+            for group_errors, group_report in tqdm(executor.map(worker, file_groups.values(), chunksize=chunksize),
+                                                   total=len(file_groups), desc="Converting sql to snowflake style"):
+                errors.extend(group_errors)
+                add_report(group_report)
+
+    if report['skipped']:
+        write_timeout_report(args.timeout_report, report['skipped'])
+    if clustering is not None:
+        write_cluster_report(args.cluster_report, report['tables'])
+    if errors:
+        print(f"[ERROR] {len(errors)} of {len(src_sql_files)} files could not be converted.", file=sys.stderr)
+        for error in errors:
+            print(f"[ERROR] {error}", file=sys.stderr)
+        sys.exit(1)
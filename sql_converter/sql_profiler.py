@@ -0,0 +1,242 @@
+"""Rule profiler for sql_converter.py (--profile).
+
+The regex engine is profiled by replacing the compiled `*_re` patterns of the converter module with
+proxies that count and time every match() call, so make_snow() itself is not changed. Helper regexes
+are reported under the rule they belong to (e.g. every redash_* pattern under `redash`). The tokenizer
+engine is profiled by wrapping its rule_* functions. Lines are timed by wrapping the input file.
+
+With --statements or --cluster_by a statement is converted once all its lines have been read, so the
+time between two lines is not the time of a line: whole statements are timed instead, and the rules
+count the statements they were tried on and matched (see RuleProfiler(statements=True)).
+"""
+import heapq
+import json
+import re
+import time
+
+if __package__:
+    from .sql_tokenizer import split_statements
+else:
+    from sql_tokenizer import split_statements
+
+# regex name prefix => rule the regex belongs to
+RULE_GROUPS = {
+    'comment_line_': 'general',
+    'whitespace_line_': 'general',
+    'comma_line_': 'general',
+    'statement_term_': 'general',
+    'clause_term_': 'general',
+    'redash_': 'redash',
+    'listagg_': 'listagg',
+    'new_listagg_': 'listagg',
+    'list_distinct_': 'listagg',
+    'f_list_distinct_': 'listagg',
+    'string_plus_': 'string_plus',
+    'comment_plus_': 'string_plus',
+    'lowercase_': 'lowercase_schema',
+    'avg_': 'avg',
+    'denial_ai_vi_': 'avg',
+    'previous_order_by_': 'rows_unbounded',
+    'array_parse_': 'array',
+    'schema_temp_': 'schema',
+    'parse_json_': 'json',
+    'unknown_': 'nvl',
+    'sysdate_ignore_': 'sysdate',
+    'bigint_': 'integer',
+    'rule_keyword_': 'keyword_scan',
+}
+
+
+def rule_name(name):
+    for prefix, rule in RULE_GROUPS.items():
+        if name.startswith(prefix):
+            return rule
+    return re.sub('_re$|^rule_', '', name)
+
+
+class RuleStats:
+    __slots__ = ('lines', 'matched', 'calls', 'total_time', 'max_time', 'last_line', 'last_matched_line')
+
+    def __init__(self):
+        self.lines = 0
+        self.matched = 0
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_line = None
+        self.last_matched_line = None
+
+    def add(self, line_no, elapsed, matched):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if self.last_line != line_no:
+            self.lines += 1
+            self.last_line = line_no
+        if matched and self.last_matched_line != line_no:
+            self.matched += 1
+            self.last_matched_line = line_no
+
+
+class ProfiledPattern:
+    """Compiled regex that records its match() calls. Everything else is passed through."""
+
+    def __init__(self, pattern, stats, profiler):
+        self.pattern = pattern
+        self.stats = stats
+        self.profiler = profiler
+
+    def match(self, string, *args):
+        start = time.perf_counter()
+        result = self.pattern.match(string, *args)
+        self.stats.add(self.profiler.line_no, time.perf_counter() - start, result is not None)
+        return result
+
+    def finditer(self, string, *args):
+        start = time.perf_counter()
+        result = list(self.pattern.finditer(string, *args))
+        self.stats.add(self.profiler.line_no, time.perf_counter() - start, bool(result))
+        return iter(result)
+
+    def __getattr__(self, name):
+        return getattr(self.pattern, name)
+
+
+class ProfiledFile:
+    """Input file that times the conversion of each line (or statement) it hands out."""
+
+    def __init__(self, sqlin, name, profiler):
+        self.sqlin = sqlin
+        self.name = name
+        self.profiler = profiler
+
+    def __iter__(self):
+        profiler = self.profiler
+        slowest = profiler.slowest_lines.setdefault(str(self.name), [])
+        if profiler.statements:
+            yield from self.statement_lines(slowest)
+            return
+        for line_no, line in enumerate(self.sqlin, start=1):
+            profiler.line_no += 1
+            profiler.lines += 1
+            start = time.perf_counter()
+            yield line
+            self.add_slowest(slowest, (time.perf_counter() - start, line_no, line_no, line.rstrip()[:200]))
+
+    def statement_lines(self, slowest):
+        """Lines of whole statements, timed from the first line handed out until the next statement is asked for."""
+        profiler = self.profiler
+        last_line_no = 0
+        start = time.perf_counter()
+        for statement in split_statements(self.sqlin):
+            # the rules of a statement run after all its lines are read: count them for the statement
+            profiler.line_no += 1
+            profiler.lines += len(statement)
+            yield from statement
+            first_line_no, last_line_no = last_line_no + 1, last_line_no + len(statement)
+            self.add_slowest(slowest, (time.perf_counter() - start, first_line_no, last_line_no,
+                                       statement[0].rstrip()[:200]))
+            start = time.perf_counter()
+
+    def add_slowest(self, slowest, entry):
+        if len(slowest) < self.profiler.top_lines:
+            heapq.heappush(slowest, entry)
+        else:
+            heapq.heappushpop(slowest, entry)
+
+
+class RuleProfiler:
+    def __init__(self, top_lines=5, statements=False):
+        self.top_lines = top_lines
+        # time and count statements instead of lines (--statements, --cluster_by)
+        self.statements = statements
+        self.unit = 'statement' if statements else 'line'
+        self.stats = {}
+        self.slowest_lines = {}
+        # number of the line (or statement) being converted, the unit rules are counted in
+        self.line_no = 0
+        self.lines = 0
+        self.originals = []
+
+    def rule_stats(self, name):
+        return self.stats.setdefault(rule_name(name), RuleStats())
+
+    def install(self, namespace):
+        """Replace the compiled *_re patterns in a module namespace (e.g. globals() of sql_converter.py)."""
+        for name, value in list(namespace.items()):
+            if name.endswith('_re') and isinstance(value, re.Pattern):
+                self.originals.append((namespace, name, value))
+                namespace[name] = ProfiledPattern(value, self.rule_stats(name), self)
+
+    def install_token_rules(self, module):
+        """Wrap the rule_* functions of sql_tokenizer."""
+        wrapped = {}
+        for name, value in list(vars(module).items()):
+            if name.startswith('rule_') and callable(value):
+                wrapped[value] = self.profiled_rule(value, self.rule_stats(name))
+                self.originals.append((vars(module), name, value))
+                setattr(module, name, wrapped[value])
+        self.originals.append((vars(module), 'TOKEN_RULES', module.TOKEN_RULES))
+        module.TOKEN_RULES = [wrapped.get(rule, rule) for rule in module.TOKEN_RULES]
+
+    def profiled_rule(self, rule, stats):
+        def wrapper(line, *args):
+            comments = len(line.comments)
+            start = time.perf_counter()
+            result = rule(line, *args)
+            stats.add(self.line_no, time.perf_counter() - start, len(line.comments) > comments)
+            return result
+        return wrapper
+
+    def uninstall(self):
+        for namespace, name, value in reversed(self.originals):
+            namespace[name] = value
+        self.originals = []
+
+    def wrap(self, sqlin, name=None):
+        return ProfiledFile(sqlin, name or sqlin.name, self)
+
+    def report(self):
+        rules = sorted(self.stats.items(), key=lambda item: item[1].total_time, reverse=True)
+        unit = self.unit
+        return {
+            'lines': self.lines,
+            **({'statements': self.line_no} if self.statements else {}),
+            'rules': [
+                {
+                    'rule': name,
+                    f'{unit}s_tried': stats.lines,
+                    f'{unit}s_matched': stats.matched,
+                    'calls': stats.calls,
+                    'total_ms': round(stats.total_time * 1000, 3),
+                    'max_ms': round(stats.max_time * 1000, 3),
+                }
+                for name, stats in rules
+            ],
+            f'slowest_{unit}s': {
+                filename: [
+                    {'line': line_no, 'last_line': last_line_no, 'ms': round(elapsed * 1000, 3), 'sql': sql}
+                    if self.statements else {'line': line_no, 'ms': round(elapsed * 1000, 3), 'sql': sql}
+                    for elapsed, line_no, last_line_no, sql in sorted(entries, reverse=True)
+                ]
+                for filename, entries in self.slowest_lines.items()
+            },
+        }
+
+    def write_report(self, path):
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        unit = self.unit
+        print(f"{'rule':<28}{unit + 's tried':>18}{'matched':>10}{'calls':>10}{'total ms':>12}{'max ms':>10}")
+        for rule in report['rules']:
+            print(f"{rule['rule']:<28}{rule[f'{unit}s_tried']:>18}{rule[f'{unit}s_matched']:>10}{rule['calls']:>10}"
+                  f"{rule['total_ms']:>12.3f}{rule['max_ms']:>10.3f}")
+        slowest = sorted(((entry['ms'], filename, entry['line'], entry.get('last_line', entry['line']))
+                          for filename, entries in report[f'slowest_{unit}s'].items() for entry in entries),
+                         reverse=True)[:self.top_lines]
+        for ms, filename, line_no, last_line_no in slowest:
+            lines = f"{line_no}-{last_line_no}" if self.statements else line_no
+            print(f"slowest {unit}: {filename}:{lines} {ms:.3f} ms")
+        print(f"profile written to {path}")
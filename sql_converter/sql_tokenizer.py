@@ -0,0 +1,847 @@
+"""Tokenizer based conversion engine for sql_converter.py (--engine tokenizer).
+
+Each line is lexed once into tokens (whitespace, comments, strings, quoted identifiers, numbers, words
+and punctuation) and the rewrites of make_snow() are applied as transforms over the token list, so the
+cost of a line stays linear in its length. Transforms never insert or remove tokens: they rewrite the
+text of existing tokens (an empty text deletes a token), which keeps the parenthesis index built once
+per line valid for every rule.
+
+The transforms implement the rewrites documented next to the regexes in sql_converter.py. Where a regex
+rewrites more than its comment describes (e.g. `now` inside `knowledge`), this engine only rewrites the
+documented construct, so its output is not byte-identical to the regex engine.
+"""
+import re
+from pathlib import Path
+
+token_re = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--.*)
+  | (?P<block_comment>/\*.*?(?P<block_comment_end>\*/|$))
+  | (?P<string>'(?:[^']|'')*(?P<string_end>'|$))
+  | (?P<quoted>"(?:[^"]|"")*"?)
+  | (?P<backtick>`[^`]*`?)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)
+  | (?P<word>[^\W\d]\w*|\$\d+)
+  | (?P<op>::|\|\||<<|>>|<=|>=|<>|!=|\{\{|\}\}|.)
+""", re.VERBOSE | re.DOTALL)
+
+# continuation of a string literal or block comment opened on a previous line
+string_continuation_re = re.compile("(?:[^']|'')*'")
+block_comment_continuation_re = re.compile(r'.*?\*/', re.DOTALL)
+
+NON_CODE = ('ws', 'comment', 'block_comment')
+
+# word => Snowflake word
+RENAMES = {
+    'NVARCHAR': 'VARCHAR',
+    'NCHAR': 'CHAR',
+    'BPCHAR': 'CHAR',
+    'DATE_ADD': 'DATEADD',
+    'DATE_DIFF': 'DATEDIFF',
+    'PGDATE_PART': 'DATE_PART',
+    'CEILING': 'CEIL',
+    'FLOAT4': 'FLOAT',
+    'FLOAT8': 'FLOAT',
+    'LONGTEXT': 'STRING',
+    'MEDIUMTEXT': 'STRING',
+    'AUTO_INCREMENT': 'AUTOINCREMENT',
+    'INTEGER': 'numeric(18,0)',
+    'BIGINT': 'numeric(18,0)',
+}
+
+
+class Token:
+    __slots__ = ('kind', 'value', 'text')
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.value = text.upper() if kind == 'word' else text
+        self.text = text
+
+
+def lex(sql, open_kind=None):
+    """Split a line into tokens. Returns the tokens and the kind of token left open at the end of the line."""
+    tokens = []
+    pos = 0
+    if open_kind:
+        continuation_re = string_continuation_re if open_kind == 'string' else block_comment_continuation_re
+        m = continuation_re.match(sql)
+        if m is None:
+            return [Token(open_kind, sql)], open_kind
+        tokens.append(Token(open_kind, m.group()))
+        pos = m.end()
+        open_kind = None
+
+    for m in token_re.finditer(sql, pos):
+        kind, text = m.lastgroup, m.group()
+        if kind == 'string':
+            open_kind = None if m.group('string_end') else 'string'
+        elif kind == 'block_comment':
+            open_kind = None if m.group('block_comment_end') else 'block_comment'
+        elif kind == 'backtick':
+            # MySQL quoted identifier => plain identifier
+            kind, text = 'word', text.strip('`')
+        tokens.append(Token(kind, text))
+    return tokens, open_kind
+
+
+class TokenLine:
+    """Tokens of one line with the helpers the rules share."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pairs = {}
+        self.words = {}
+        self.comments = []
+        self.changed = False
+        # set by rules that comment out the rest of the statement ('statement') or of a clause ('clause')
+        self.comment_out_from = None
+        self.comment_out_kind = None
+        # set when DISTKEY / SORTKEY ends the line and its column list starts the next one
+        self.pending_key_list = False
+
+        stack = []
+        for i, token in enumerate(tokens):
+            if token.kind == 'word':
+                self.words.setdefault(token.value, []).append(i)
+            elif token.kind == 'op':
+                if token.text in ('(', '['):
+                    stack.append(i)
+                elif token.text in (')', ']') and stack:
+                    j = stack.pop()
+                    self.pairs[i], self.pairs[j] = j, i
+
+    def find(self, *values):
+        """Indexes of the words with the given values that no rule has deleted yet."""
+        return sorted(i for value in values for i in self.words.get(value, ()) if self.tokens[i].text)
+
+    def next_code(self, i):
+        for j in range(i + 1, len(self.tokens)):
+            if self.tokens[j].kind not in NON_CODE and self.tokens[j].text:
+                return j
+        return None
+
+    def prev_code(self, i):
+        for j in range(i - 1, -1, -1):
+            if self.tokens[j].kind not in NON_CODE and self.tokens[j].text:
+                return j
+        return None
+
+    def is_word(self, i, *values):
+        return i is not None and self.tokens[i].kind == 'word' and self.tokens[i].value in values
+
+    def is_op(self, i, *ops):
+        return i is not None and self.tokens[i].kind == 'op' and self.tokens[i].text in ops
+
+    def text(self, i, j):
+        return ''.join(token.text for token in self.tokens[i:j + 1])
+
+    def args(self, open_index):
+        """Top-level argument token ranges between a '(' and its matching ')'."""
+        close_index = self.pairs[open_index]
+        args, start, i = [], open_index + 1, open_index + 1
+        while i < close_index:
+            if self.is_op(i, '(', '[') and i in self.pairs:
+                i = self.pairs[i]
+            elif self.is_op(i, ','):
+                args.append((start, i - 1))
+                start = i + 1
+            i += 1
+        args.append((start, close_index - 1))
+        return [(a, b) for a, b in args if self.text(a, b).strip()]
+
+    def set_text(self, i, new_text):
+        self.tokens[i].text = new_text
+        self.changed = True
+
+    def replace(self, i, j, new_text, comment=None):
+        original = self.text(i, j)
+        self.set_text(i, new_text)
+        for token in self.tokens[i + 1:j + 1]:
+            token.text = ''
+        self.comments.append(original.strip() if comment is None else comment)
+        return original
+
+    def drop(self, i, j):
+        """Delete tokens i..j together with the whitespace in front of them."""
+        if i > 0 and self.tokens[i - 1].kind == 'ws':
+            self.tokens[i - 1].text = ''
+        return self.replace(i, j, '')
+
+    def comment_out(self, i, kind):
+        if self.comment_out_from is None or i < self.comment_out_from:
+            self.comment_out_from, self.comment_out_kind = i, kind
+
+
+def rule_renames(line):
+    # NVARCHAR => VARCHAR, DATE_ADD => DATEADD, FLOAT8 => FLOAT, integer/bigint => numeric(18,0), ...
+    for value, new_value in RENAMES.items():
+        for i in line.find(value):
+            line.replace(i, i, new_value)
+    # json => variant (the type, not a function call such as json_extract_path_text)
+    for i in line.find('JSON'):
+        if not line.is_op(line.next_code(i), '('):
+            line.replace(i, i, 'VARIANT')
+
+
+def rule_character_varying(line):
+    # character varying => varchar
+    for i in line.find('CHARACTER'):
+        j = line.next_code(i)
+        if line.is_word(j, 'VARYING'):
+            line.replace(i, j, 'varchar')
+
+
+def rule_char_length_unit(line):
+    # CHAR(n BYTE) => CHAR(n)
+    for value in ('CHAR', 'VARCHAR', 'NCHAR', 'NVARCHAR'):
+        for i in line.find(value):
+            open_index = line.next_code(i)
+            if not line.is_op(open_index, '(') or open_index not in line.pairs:
+                continue
+            n = line.next_code(open_index)
+            unit = line.next_code(n) if n is not None and line.tokens[n].kind == 'number' else None
+            if line.is_word(unit, 'BYTE', 'CHAR', 'CHARACTERS') and line.next_code(unit) == line.pairs[open_index]:
+                line.drop(unit, unit)
+
+
+def rule_now(line):
+    # 'now'::character varying => CURRENT_TIMESTAMP, now() => CURRENT_TIMESTAMP()
+    for i, token in enumerate(line.tokens):
+        if token.kind == 'string' and token.value.lower() == "'now'":
+            cast = line.next_code(i)
+            type_index = line.next_code(cast) if cast is not None else None
+            if line.is_op(cast, '::') and line.is_word(type_index, 'TEXT', 'VARCHAR', 'CHARACTER'):
+                end = type_index
+                if line.is_word(type_index, 'CHARACTER') and line.is_word(line.next_code(type_index), 'VARYING'):
+                    end = line.next_code(type_index)
+                line.replace(i, end, 'CURRENT_TIMESTAMP')
+    for i in line.find('NOW'):
+        open_index = line.next_code(i)
+        # now( ending the line has no closing parenthesis on it
+        if line.is_op(open_index, '(') and open_index in line.pairs \
+                and line.next_code(open_index) == line.pairs[open_index]:
+            line.replace(i, line.pairs[open_index], 'CURRENT_TIMESTAMP()')
+
+
+def rule_default(line):
+    for i in line.find('DEFAULT'):
+        j = line.next_code(i)
+        if j is None:
+            continue
+        token = line.tokens[j]
+        # DEFAULT SYSDATE => deleted (Snowflake DEFAULT must be literal)
+        if line.is_word(j, 'SYSDATE'):
+            line.drop(i, j)
+        # DEFAULT "identity"(start, 0, '(1,1)'::text) => IDENTITY(start,1)
+        elif line.is_word(j, 'IDENTITY') or token.value.lower() == '"identity"':
+            open_index = line.next_code(j)
+            if line.is_op(open_index, '(') and open_index in line.pairs:
+                args = line.args(open_index)
+                start = line.text(*args[0]).strip() if args else '1'
+                line.replace(i, line.pairs[open_index], f'IDENTITY({start},1)')
+        # default '0' => DEFAULT 0
+        elif token.kind == 'string' and token.value == "'0'":
+            line.replace(i, j, 'DEFAULT 0')
+        # default '0000-00-00' => default '0000-00-00'::DATE
+        elif token.kind == 'string' and token.value == "'0000-00-00'":
+            line.replace(j, j, f'{token.text}::DATE')
+        # default '0000-00-00 00:00:00' => default '0000-00-00 00:00:00'::TIMESTAMP
+        elif token.kind == 'string' and token.value.startswith("'0000-00-00 00:00:00"):
+            line.replace(j, j, f'{token.text}::TIMESTAMP')
+
+
+def rule_sysdate(line):
+    # SYSDATE => CURRENT_TIMESTAMP()
+    for i in line.find('SYSDATE'):
+        line.replace(i, i, 'CURRENT_TIMESTAMP()')
+
+
+def rule_pg_catalog(line):
+    # PG_CATALOG.name => name
+    for i in line.find('PG_CATALOG'):
+        dot = line.next_code(i)
+        if line.is_op(dot, '.'):
+            line.replace(i, dot, '')
+
+
+def rule_trunc(line):
+    for i in line.find('TRUNC'):
+        open_index = line.next_code(i)
+        if not line.is_op(open_index, '(') or open_index not in line.pairs:
+            continue
+        close_index = line.pairs[open_index]
+        args = line.args(open_index)
+        inner = line.next_code(open_index)
+        # trunc((CURRENT_TIMESTAMP)::timestamp) => DATE_TRUNC('DAY', CURRENT_TIMESTAMP)
+        if len(args) == 1 and line.is_op(inner, '(') and inner in line.pairs:
+            cast = line.next_code(line.pairs[inner])
+            if line.is_op(cast, '::') and line.is_word(line.next_code(cast), 'TIMESTAMP'):
+                timespec = line.text(inner + 1, line.pairs[inner] - 1).strip()
+                line.replace(i, close_index, f"DATE_TRUNC('DAY', {timespec})")
+        # trunc(col, 'MM') - 1 => dateadd('MM', -1, trunc(col, 'MM'))
+        elif len(args) == 2 and line.tokens[line.next_code(args[1][0] - 1)].kind == 'string':
+            minus = line.next_code(close_index)
+            offset = line.next_code(minus)
+            if line.is_op(minus, '-') and offset is not None and line.tokens[offset].kind == 'number':
+                col = line.text(*args[0]).strip()
+                units = line.text(*args[1]).strip()
+                line.replace(i, offset, f'dateadd({units}, -{line.tokens[offset].text}, trunc({col}, {units}))')
+
+
+def rule_delete(line):
+    # DELETE table => DELETE FROM table
+    for i in line.find('DELETE'):
+        j = line.next_code(i)
+        if j is not None and line.tokens[j].kind in ('word', 'quoted') and not line.is_word(j, 'FROM'):
+            line.replace(i, i, f'{line.tokens[i].text} FROM', comment=line.tokens[i].text)
+
+
+def rule_rows_unbounded(line, previous_line):
+    # min(a) OVER(PARTITION BY b ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) => min(a) OVER(PARTITION BY b)
+    # (not without ORDER BY, where the frame changes the result)
+    clause = ('ROWS', 'BETWEEN', 'UNBOUNDED', 'PRECEDING', 'AND', 'UNBOUNDED', 'FOLLOWING')
+    for i in line.find('ROWS'):
+        j, end = i, i
+        for value in clause[1:]:
+            j = line.next_code(j)
+            if not line.is_word(j, value):
+                break
+            end = j
+        else:
+            # ORDER BY inside the same window, or on the previous line when the window starts there
+            open_index = i - 1
+            depth = 0
+            while open_index >= 0:
+                if line.is_op(open_index, ')'):
+                    depth += 1
+                elif line.is_op(open_index, '('):
+                    if depth == 0:
+                        break
+                    depth -= 1
+                open_index -= 1
+            if open_index >= 0:
+                window = line.tokens[open_index:i]
+            else:
+                window = line.tokens[:i]
+            window_values = [token.value for token in window if token.kind == 'word']
+            has_order_by = 'ORDER' in window_values
+            if open_index < 0 and previous_line and re.search(r'ORDER\s+BY', previous_line, re.IGNORECASE):
+                has_order_by = True
+            if not has_order_by:
+                line.drop(i, end)
+
+
+def rule_create_table(line):
+    # CREATE TABLE => CREATE OR REPLACE TABLE (not CREATE TABLE IF NOT EXISTS)
+    for i in line.find('CREATE'):
+        j = line.next_code(i)
+        if line.is_word(j, 'TABLE') and not line.is_word(line.next_code(j), 'IF'):
+            line.replace(i, i, f'{line.tokens[i].text} OR REPLACE', comment=line.text(i, j))
+
+
+def rule_create_view_schema(line, filename):
+    # create view name => create view schema.name (schema from the file name schema.name.sql)
+    if not filename:
+        return
+    schema = Path(filename).name.split('.')
+    if len(schema) < 3:
+        return
+    for i in line.find('VIEW'):
+        j = line.prev_code(i)
+        while line.is_word(j, 'OR', 'REPLACE', 'MATERIALIZED', 'LATE', 'BINDING'):
+            j = line.prev_code(j)
+        if not line.is_word(j, 'CREATE'):
+            continue
+        name = line.next_code(i)
+        if name is not None and line.tokens[name].kind in ('word', 'quoted') and not line.is_op(line.next_code(name), '.'):
+            line.replace(name, name, f'{schema[0]}.{line.tokens[name].text}', comment=line.tokens[name].text)
+
+
+def rule_statements(line, statement_start=True):
+    # ALTER TABLE / GRANT / REVOKE / CREATE INDEX / SET ... => ignore through end of statement
+    first = line.next_code(-1)
+    if line.is_word(first, 'ALTER', 'GRANT', 'REVOKE') or (statement_start and line.is_word(first, 'SET')):
+        line.comment_out(first, 'statement')
+    elif line.is_word(first, 'SET') and first == 0:
+        # SET starting a line inside a statement (UPDATE) => ignore the line, as the regex engine does
+        terminator = next((i for i in range(len(line.tokens) - 1, first, -1) if line.is_op(i, ';')), None)
+        line.drop(first, len(line.tokens) - 1 if terminator is None else terminator - 1)
+    for i in line.find('INDEX'):
+        j = line.prev_code(i)
+        if line.is_word(j, 'UNIQUE', 'BITMAP'):
+            j = line.prev_code(j)
+        if line.is_word(j, 'CREATE'):
+            line.comment_out(j, 'statement')
+
+
+def rule_table_attributes(line):
+    # ENCODE type, DISTSTYLE type, DISTKEY(col), SORTKEY(col), INTERLEAVED, CHARSET=utf8, unsigned => ignore
+    for i in line.find('ENCODE', 'DISTSTYLE'):
+        j = line.next_code(i)
+        if j is not None and line.tokens[j].kind == 'word':
+            line.drop(i, j)
+    for i in line.find('DISTKEY', 'SORTKEY'):
+        start = i
+        prev = line.prev_code(i)
+        if line.is_word(prev, 'INTERLEAVED', 'COMPOUND'):
+            start = prev
+        j = line.next_code(i)
+        if line.is_op(j, '('):
+            if j in line.pairs:
+                line.drop(start, line.pairs[j])
+            else:
+                # SORTKEY ( spanning lines => ignore through end of statement
+                line.comment_out(start, 'clause')
+        elif line.is_word(j, 'AUTO', 'EVEN', 'ALL', 'KEY'):
+            line.drop(start, j)
+        else:
+            line.drop(start, i)
+            if j is None:
+                line.pending_key_list = True
+    for i in line.find('CHARSET', 'CHARACTER'):
+        start, j = i, line.next_code(i)
+        if line.is_word(i, 'CHARACTER'):
+            if not line.is_word(j, 'SET'):
+                continue
+            j = line.next_code(j)
+        if line.is_op(j, '='):
+            j = line.next_code(j)
+        if line.is_word(line.prev_code(start), 'DEFAULT'):
+            start = line.prev_code(start)
+        if line.is_word(j, 'UTF8'):
+            line.drop(start, j)
+    for i in line.find('UNSIGNED'):
+        line.drop(i, i)
+
+
+def is_column_type(line, i):
+    """True for a type at column-definition position: `name TYPE` opening the line or after `(` / `,`,
+    or a type alone at the start of the line. Casts such as `::numeric(18,2)` and `AS numeric(12,4)` are not."""
+    name = line.prev_code(i)
+    if name is None:
+        return True
+    if line.tokens[name].kind not in ('word', 'quoted'):
+        return False
+    before = line.prev_code(name)
+    return before is None or line.is_op(before, '(', ',')
+
+
+def rule_numeric_types(line):
+    # INT(n) => numeric(18,0)
+    for i in line.find('INT'):
+        j = line.next_code(i)
+        if line.is_op(j, '(') and j in line.pairs:
+            line.replace(i, line.pairs[j], 'numeric(18,0)')
+    # numeric(x,y>0) => double (column types only, not casts), decimal(n>38,m) => decimal(38,m)
+    for i in line.find('NUMERIC', 'DECIMAL'):
+        j = line.next_code(i)
+        if not line.is_op(j, '(') or j not in line.pairs:
+            continue
+        args = [line.text(a, b).strip() for a, b in line.args(j)]
+        if len(args) != 2 or not all(arg.isdigit() for arg in args):
+            continue
+        if line.is_word(i, 'NUMERIC') and int(args[1]) > 0 and is_column_type(line, i):
+            line.replace(i, line.pairs[j], 'double')
+        elif line.is_word(i, 'DECIMAL') and int(args[0]) > 38:
+            line.replace(i, line.pairs[j], f'DECIMAL(38,{args[1]})')
+    # float|double(n,m) => float|double
+    for i in line.find('FLOAT', 'DOUBLE'):
+        j = line.next_code(i)
+        if line.is_op(j, '(') and j in line.pairs and len(line.args(j)) == 2:
+            line.replace(i, line.pairs[j], line.tokens[i].text)
+
+
+def rule_brackets(line):
+    # ARRAY[1, 2] => [1, 2]
+    for i in line.find('ARRAY'):
+        if line.is_op(line.next_code(i), '['):
+            line.replace(i, i, '')
+    # [column] => column (not an index such as col[0])
+    for i, token in enumerate(line.tokens):
+        if token.kind == 'op' and token.text == '[' and i in line.pairs:
+            j = line.next_code(i)
+            prev = line.prev_code(i)
+            if line.next_code(j) == line.pairs[i] and line.tokens[j].kind == 'word' \
+                    and not (prev is not None and (line.tokens[prev].kind == 'word' or line.is_op(prev, ')', ']'))):
+                line.set_text(i, '')
+                line.set_text(line.pairs[i], '')
+
+
+def rule_string_plus(line):
+    # 'a' + b => 'a' || b
+    for i, token in enumerate(line.tokens):
+        if token.kind == 'op' and token.text == '+':
+            prev, nxt = line.prev_code(i), line.next_code(i)
+            if (prev is not None and line.tokens[prev].kind == 'string') or \
+                    (nxt is not None and line.tokens[nxt].kind == 'string'):
+                original = line.text(i if prev is None else prev, i if nxt is None else nxt).strip()
+                line.replace(i, i, '||', comment=original)
+
+
+def rule_schema_upper(line):
+    # schema.table => SCHEMA.TABLE ({{ param }} templates are left as they are)
+    if 'ORDER' in line.words:
+        return
+    in_template = False
+    for i, token in enumerate(line.tokens):
+        if token.kind == 'op' and token.text in ('{{', '}}'):
+            in_template = token.text == '{{'
+        elif not in_template and token.kind == 'op' and token.text == '.':
+            prev, nxt = line.prev_code(i), line.next_code(i)
+            if prev == i - 1 and nxt == i + 1 and line.tokens[prev].kind == 'word' and line.tokens[nxt].kind == 'word':
+                original = line.text(prev, nxt)
+                if original != original.upper():
+                    line.set_text(prev, line.tokens[prev].text.upper())
+                    line.set_text(nxt, line.tokens[nxt].text.upper())
+                    line.comments.append(original)
+
+
+def rule_similar_to(line):
+    # a SIMILAR TO '%(b|c)%' => REGEXP_LIKE(a, '.*(b|c).*')
+    for i in line.find('SIMILAR'):
+        to = line.next_code(i)
+        pattern = line.next_code(to)
+        if not line.is_word(to, 'TO') or pattern is None or line.tokens[pattern].kind != 'string':
+            continue
+        operand_end = line.prev_code(i)
+        negate = line.is_word(operand_end, 'NOT')
+        if negate:
+            operand_end = line.prev_code(operand_end)
+        if operand_end is None or line.tokens[operand_end].kind not in ('word', 'quoted'):
+            line.comments.append('warning: SIMILAR TO operand is not a column, write it down.')
+            continue
+        # qualified column such as t.col
+        start = operand_end
+        while line.is_op(line.prev_code(start), '.') and line.prev_code(line.prev_code(start)) is not None:
+            start = line.prev_code(line.prev_code(start))
+        operand = line.text(start, operand_end).strip()
+        regex = line.tokens[pattern].text.replace('%', '.*').replace('_', '.')
+        line.replace(start, pattern, f"{'NOT ' if negate else ''}REGEXP_LIKE({operand}, {regex})")
+
+
+def rule_jst(line):
+    # 'JST' => 'Japan'
+    for i, token in enumerate(line.tokens):
+        if token.kind == 'string' and token.value == "'JST'":
+            line.replace(i, i, "'Japan'", comment="'Japan'")
+
+
+def rule_avg(line):
+    # AVG() => TRUNC(AVG()) (not inside f_ai/f_vi)
+    if 'F_AI' in line.words or 'F_VI' in line.words:
+        return
+    for i in line.find('AVG'):
+        j = line.next_code(i)
+        if line.is_op(j, '(') and j in line.pairs:
+            close_index = line.pairs[j]
+            line.comments.append(line.text(i, close_index))
+            line.set_text(i, f'TRUNC({line.tokens[i].text}')
+            line.set_text(close_index, '))')
+
+
+def rule_listagg(line):
+    # LISTAGG(DISTINCT name, '/') WITHIN GROUP (ORDER BY id DESC)
+    # => f_list_distinct(LISTAGG(name, '/') WITHIN GROUP (ORDER BY id DESC), '/')
+    for i in line.find('LISTAGG'):
+        open_index = line.next_code(i)
+        if not line.is_op(open_index, '(') or open_index not in line.pairs:
+            continue
+        distinct = line.next_code(open_index)
+        if not line.is_word(distinct, 'DISTINCT'):
+            continue
+        within = line.next_code(line.pairs[open_index])
+        group = line.next_code(within)
+        order_open = line.next_code(group)
+        args = line.args(open_index)
+        if not (line.is_word(within, 'WITHIN') and line.is_word(group, 'GROUP')
+                and line.is_op(order_open, '(') and order_open in line.pairs) or len(args) != 2:
+            line.comments.append('warning: no within group order by, write it down.')
+            continue
+        delimiter = line.text(*args[1]).strip()
+        end = line.pairs[order_open]
+        line.comments.append(line.text(i, end))
+        line.set_text(i, f'f_list_distinct({line.tokens[i].text}')
+        line.set_text(distinct, '')
+        if line.tokens[distinct + 1].kind == 'ws':
+            line.set_text(distinct + 1, '')
+        line.set_text(end, f'), {delimiter})')
+
+
+def rule_null_second_argument(line):
+    # coalesce(col1) => coalesce(col1, null), nvl(col1) => nvl(col1, null)
+    for i in line.find('COALESCE', 'NVL'):
+        j = line.next_code(i)
+        if line.is_op(j, '(') and j in line.pairs and len(line.args(j)) == 1:
+            close_index = line.pairs[j]
+            line.comments.append(line.text(i, close_index))
+            line.set_text(close_index, ', null)')
+
+
+def rule_json_extract_array_element_text(line):
+    # json_extract_array_element_text(json, pos) => parse_json(json)[pos]
+    for i in line.find('JSON_EXTRACT_ARRAY_ELEMENT_TEXT'):
+        j = line.next_code(i)
+        if line.is_op(j, '(') and j in line.pairs:
+            args = [line.text(a, b).strip() for a, b in line.args(j)]
+            if len(args) in (2, 3):
+                line.replace(i, line.pairs[j], f'parse_json({args[0]})[{args[1]}]')
+
+
+def rule_empty_comma(line):
+    # Empty Comma => ignore (dropping out clauses can leave an empty comma)
+    code = [i for i, token in enumerate(line.tokens) if token.kind not in NON_CODE and token.text]
+    if len(code) == 1 and line.is_op(code[0], ',') and line.tokens[-1].kind == 'comment' and line.tokens[0].kind == 'ws':
+        line.replace(code[0], code[0], '')
+
+
+TOKEN_RULES = [
+    rule_table_attributes,
+    rule_default,
+    rule_now,
+    rule_sysdate,
+    rule_char_length_unit,
+    rule_renames,
+    rule_character_varying,
+    rule_pg_catalog,
+    rule_trunc,
+    rule_delete,
+    rule_create_table,
+    rule_numeric_types,
+    rule_brackets,
+    rule_string_plus,
+    rule_schema_upper,
+    rule_similar_to,
+    rule_jst,
+    rule_avg,
+    rule_listagg,
+    rule_null_second_argument,
+    rule_json_extract_array_element_text,
+]
+
+
+def convert_line(tokens, filename, previous_line, pending=None, statement_start=True):
+    """
+    Apply every rule to one line. Returns the line and whether the following lines are commented out
+    ('statement' or 'clause') or start with the column list of a key ('key_list').
+    `statement_start` is False when the line continues a statement of the previous lines.
+    """
+    line = TokenLine(tokens)
+    if pending == 'key_list':
+        # DISTKEY / SORTKEY ended the previous line => ignore its column list
+        first = line.next_code(-1)
+        if line.is_op(first, '('):
+            if first in line.pairs:
+                line.drop(first, line.pairs[first])
+            else:
+                line.comment_out(first, 'clause')
+    rule_statements(line, statement_start)
+    # a statement that is commented out from its first token is not converted
+    if line.comment_out_from is None or line.comment_out_from > line.next_code(-1):
+        for rule in TOKEN_RULES:
+            rule(line)
+        rule_rows_unbounded(line, previous_line)
+        rule_create_view_schema(line, filename)
+
+    comment_lines = None
+    if line.comment_out_from is not None:
+        start = line.comment_out_from
+        terminator = next((i for i in range(start, len(tokens)) if line.is_op(i, ';')), None)
+        if terminator is None:
+            line.drop(start, len(tokens) - 1)
+            comment_lines = line.comment_out_kind
+        else:
+            # a clause keeps the statement's terminator, a statement is dropped with it
+            line.drop(start, terminator if line.comment_out_kind == 'statement' else terminator - 1)
+    elif line.pending_key_list:
+        comment_lines = 'key_list'
+    rule_empty_comma(line)
+    return line, comment_lines
+
+
+def split_statements(sqlin):
+    """Group source lines into complete statements.
+
+    A statement ends with the line whose last code token is `;` outside any string or block comment;
+    trailing lines without a terminator form the last statement.
+    """
+    statement = []
+    open_kind = None
+    for line in sqlin:
+        statement.append(line)
+        tokens, open_kind = lex(line.rstrip(), open_kind)
+        last = next((token for token in reversed(tokens) if token.kind not in NON_CODE), None)
+        if open_kind is None and last is not None and last.kind == 'op' and last.text == ';':
+            yield statement
+            statement = []
+    if statement:
+        yield statement
+
+
+def paren_names(tokens, i):
+    """Comma separated names in the parentheses opening at tokens[i], and the index after the closing one."""
+    names = ['']
+    depth = 0
+    for i in range(i, len(tokens)):
+        if tokens[i].value == '(':
+            depth += 1
+        elif tokens[i].value == ')':
+            depth -= 1
+            if depth == 0:
+                return [name for name in names if name], i + 1
+        elif depth == 1 and tokens[i].value == ',':
+            names.append('')
+        elif depth == 1:
+            names[-1] += tokens[i].text
+    return [name for name in names if name], len(tokens)
+
+
+def table_keys(statement):
+    """Table name, DISTSTYLE, DISTKEY and SORTKEY of a CREATE TABLE statement (its source lines).
+
+    Returns None for other statements. Column level keys (`id int DISTKEY`) and table attributes
+    (`DISTKEY (id) COMPOUND SORTKEY (a, b)`) are both recognized; sort_style is 'compound',
+    'interleaved', 'auto' or None.
+    """
+    tokens = []
+    open_kind = None
+    for line in statement:
+        line_tokens, open_kind = lex(line.rstrip(), open_kind)
+        tokens += [token for token in line_tokens if token.kind not in NON_CODE]
+    values = [token.value for token in tokens] + [None, None, None]
+
+    if values[0] != 'CREATE':
+        return None
+    i = 1
+    if values[i:i + 2] == ['OR', 'REPLACE']:
+        i += 2
+    temporary = False
+    while values[i] in ('LOCAL', 'TEMP', 'TEMPORARY'):
+        temporary = True
+        i += 1
+    if values[i] != 'TABLE':
+        return None
+    i += 1
+    if values[i:i + 3] == ['IF', 'NOT', 'EXISTS']:
+        i += 3
+    start = i
+    while i < len(tokens) and tokens[i].kind in ('word', 'quoted'):
+        i += 2 if values[i + 1] == '.' else 1
+        if values[i - 1] != '.':
+            break
+    keys = {
+        'table': ''.join(token.text for token in tokens[start:i]),
+        'temporary': temporary,
+        'ctas': False,
+        'diststyle': None,
+        'distkey': [],
+        'sort_style': None,
+        'sortkey': [],
+    }
+
+    # column definitions
+    if values[i] == '(':
+        depth = 0
+        column = None
+        for i in range(i, len(tokens)):
+            if values[i] == '(':
+                depth += 1
+                column = None if depth == 1 else column
+            elif values[i] == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+            elif depth == 1 and values[i] == ',':
+                column = None
+            elif depth == 1 and column is None:
+                column = tokens[i].text
+            elif depth == 1 and values[i] == 'DISTKEY':
+                keys['distkey'] = [column]
+            elif depth == 1 and values[i] == 'SORTKEY':
+                keys['sort_style'] = 'compound'
+                keys['sortkey'] = [column]
+        i += 1
+
+    # table attributes
+    while i < len(tokens):
+        if values[i] == 'AS':
+            keys['ctas'] = True
+            break
+        if values[i] == 'DISTSTYLE' and values[i + 1]:
+            keys['diststyle'] = values[i + 1]
+            i += 2
+        elif values[i] == 'DISTKEY' and values[i + 1] == '(':
+            keys['distkey'], i = paren_names(tokens, i + 1)
+        elif values[i] in ('COMPOUND', 'INTERLEAVED') and values[i + 1] == 'SORTKEY' and values[i + 2] == '(':
+            keys['sort_style'] = values[i].lower()
+            keys['sortkey'], i = paren_names(tokens, i + 2)
+        elif values[i] == 'SORTKEY' and values[i + 1] == '(':
+            keys['sort_style'] = 'compound'
+            keys['sortkey'], i = paren_names(tokens, i + 1)
+        elif values[i] == 'SORTKEY' and values[i + 1] == 'AUTO':
+            keys['sort_style'] = 'auto'
+            i += 2
+        else:
+            i += 1
+    return keys
+
+
+def make_snow_tokens(sqlin, sqlout, no_comments):
+    """Convert source SQL to Snowflake SQL like make_snow(), with token transforms instead of regexes."""
+    for converted in snow_token_lines(sqlin, no_comments, sqlin.name):
+        sqlout.write(converted)
+
+
+def snow_token_lines(sqlin, no_comments, filename):
+    """Yield the output of each source line like snow_lines() ('' if the line was dropped)."""
+    previous_line = None
+    open_kind = None
+    # 'statement' or 'clause' while commenting out lines up to the end of the statement,
+    # 'key_list' when the next line starts with the column list of a DISTKEY / SORTKEY
+    comment_lines = None
+    # whether the line starts a statement (the previous code line ended with `;`)
+    statement_start = True
+
+    for line in sqlin:
+        sql = line.rstrip()
+        tokens, open_kind = lex(sql, open_kind)
+
+        # if current line is only comments or whitespace, don't bother with any rule
+        if all(token.kind in NON_CODE for token in tokens):
+            yield format_line(sql, None)
+            continue
+
+        last = next(token for token in reversed(tokens) if token.kind not in NON_CODE)
+        starts, statement_start = statement_start, open_kind is None and last.kind == 'op' and last.text == ';'
+
+        # if we're commenting out multiple lines, check if this is the last
+        if comment_lines in ('statement', 'clause'):
+            terminator = next((i for i, token in enumerate(tokens) if token.kind == 'op' and token.text == ';'), None)
+            if terminator is None:
+                yield format_line(None, None if no_comments else sql.strip())
+                continue
+            cut = terminator + 1 if comment_lines == 'statement' else terminator
+            kept = ''.join(token.text for token in tokens[cut:]).strip()
+            dropped = ''.join(token.text for token in tokens[:cut]).strip()
+            comment_lines = None
+            yield format_line(kept or None, None if no_comments else dropped)
+            continue
+
+        converted, comment_lines = convert_line(tokens, filename, previous_line, comment_lines, starts)
+        sql = ''.join(token.text for token in tokens).rstrip()
+        if converted.changed and sql.strip() in ('', ','):
+            sql = None  # the mods have reduced this line to empty whitespace or a single vestigial comma
+        comment = None if no_comments else ' // '.join(c for c in converted.comments if c) or None
+        yield format_line(sql, comment)
+        previous_line = sql
+
+
+def format_line(sql, comment):
+    out = ''
+    if sql is not None:
+        out += sql
+    if comment:
+        out += '\t\t--// {0}'.format(comment)
+    if sql is not None or comment:
+        out += '\n'
+    return out
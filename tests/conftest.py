@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the tools are scripts run from their own directories
+ROOT = Path(__file__).resolve().parent.parent
+for directory in ('sql_converter', 'diff_checker', 'redshift_ddl_getter'):
+    sys.path.insert(0, str(ROOT / directory))
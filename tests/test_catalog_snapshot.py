@@ -0,0 +1,49 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from catalog_snapshot import CatalogSnapshot
+from redshift_catalog import resolve_names
+
+
+def offline():
+    raise AssertionError('the catalog was read')
+
+
+def fresh_snapshot(path):
+    snapshot = CatalogSnapshot(path)
+    snapshot.listings['table'] = {'names': ['analytics.sales', 'analytics.users', 'stg.sales'],
+                                  'fetched_at': time.time()}
+    for name, rows in (('analytics.sales', 10), ('analytics.users', 3)):
+        snapshot.entries[name] = {'kind': 'table', 'oid': 1, 'rows': rows, 'columns': [['id', 'integer']],
+                                  'fingerprint': name, 'fetched_at': time.time()}
+    snapshot.save()
+    return CatalogSnapshot(path)
+
+
+def test_patterns_from_listing():
+    listing = ['analytics.sales', 'analytics.users', 'stg.sales']
+    assert resolve_names(None, ['stg.sales', 'analytics.*'], {'analytics.users'}, 'r', listing) == \
+        ['stg.sales', 'analytics.sales']
+
+
+def test_dry_run_on_fresh_snapshot(tmp_path, capsys):
+    snapshot = fresh_snapshot(tmp_path / 'snapshot.json.gz')
+    assert snapshot.dry_run(['analytics.*'], set(), 'table', offline, tmp_path / 'table', False) == 2
+    assert 'analytics.sales\twrite\t1 columns\t10 rows' in capsys.readouterr().out
+
+
+def test_fingerprints_read_the_catalog(tmp_path):
+    snapshot = fresh_snapshot(tmp_path / 'snapshot.json.gz')
+    with pytest.raises(AssertionError, match='the catalog was read'):
+        snapshot.fingerprints(['analytics.sales'], offline, 'table')
+
+
+def test_load_older_snapshot(tmp_path):
+    path = tmp_path / 'snapshot.json.gz'
+    with gzip.open(path, 'wt') as f:
+        json.dump({'analytics.sales': {'kind': 'table', 'fetched_at': 0}}, f)
+    snapshot = CatalogSnapshot(path)
+    assert list(snapshot.entries) == ['analytics.sales'] and snapshot.listings == {}
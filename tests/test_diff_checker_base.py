@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('psycopg2')
+pytest.importorskip('snowflake.sqlalchemy')
+from diff_checker_base import compare_rows, compare_values  # noqa: E402
+
+
+def rows_match(redshift, snowflake):
+    report = compare_rows(pd.DataFrame({'c': redshift}), pd.DataFrame({'c': snowflake}))
+    return report['missing_in_snowflake'] == 0 and report['extra_in_snowflake'] == 0
+
+
+def test_large_integers_are_exact():
+    assert not rows_match([3000000000001], [3000000000002])
+    assert not rows_match([1400000000000000001], [Decimal(1400000000000000999)])
+
+
+def test_integers_across_types():
+    assert rows_match([3000000000001, None], [Decimal(3000000000001), np.nan])
+    assert rows_match([True, False], [1.0, 0.0])
+    assert rows_match([2], [Decimal('2.000')])
+
+
+def test_floats_are_rounded():
+    assert rows_match([0.1 + 0.2], [Decimal('0.3')])
+
+
+def test_null_across_dtypes():
+    redshift = pd.DataFrame({'c': pd.Series([None, None], dtype=object), 't': ['a', None]})
+    snowflake = pd.DataFrame({'c': pd.Series([np.nan, np.nan], dtype='float64'), 't': ['a', np.nan]})
+    assert rows_match(redshift['c'], snowflake['c'])
+    assert rows_match(pd.Series([None, None], dtype=object), pd.Series([None, None], dtype='datetime64[ns]'))
+    report = compare_rows(redshift, snowflake)
+    assert report['missing_in_snowflake'] == report['extra_in_snowflake'] == 0
+    report = compare_values(redshift, snowflake, 0.0001)
+    assert report['columns']['c']['mismatches'] == report['columns']['t']['mismatches'] == 0
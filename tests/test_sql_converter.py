@@ -0,0 +1,12 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_import_as_package():
+    # the converter is run as a script from sql_converter/, but also imports from the repository root
+    result = subprocess.run([sys.executable, '-c', 'import sql_converter.sql_converter'], cwd=ROOT,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,31 @@
+import io
+
+import sql_converter
+from sql_profiler import RuleProfiler
+
+SQL = 'select getdate(),\n  1\nfrom x;\nselect 1;\n'
+
+
+def profile(statements):
+    profiler = RuleProfiler(statements=statements)
+    profiler.install(vars(sql_converter))
+    try:
+        list(sql_converter.convert_lines(profiler.wrap(io.StringIO(SQL), 'x.sql'), statements=statements))
+    finally:
+        profiler.uninstall()
+    return profiler.report()
+
+
+def test_lines():
+    report = profile(False)
+    assert report['lines'] == 4
+    assert sorted(entry['line'] for entry in report['slowest_lines']['x.sql']) == [1, 2, 3, 4]
+
+
+def test_statements():
+    # --statements converts a statement after reading all its lines, so whole statements are timed
+    report = profile(True)
+    assert report['lines'] == 4 and report['statements'] == 2
+    assert sorted((entry['line'], entry['last_line']) for entry in report['slowest_statements']['x.sql']) == \
+        [(1, 3), (4, 4)]
+    assert all('statements_tried' in rule for rule in report['rules'])
@@ -0,0 +1,20 @@
+from sql_tokenizer import snow_token_lines
+
+
+def convert(lines):
+    return ''.join(snow_token_lines(lines, False, 'x.sql'))
+
+
+def test_now_at_end_of_line():
+    # the closing parenthesis of now( is on the next line
+    assert convert(['select now(\n', ') as ts;\n']) == 'select now(\n) as ts;\n'
+
+
+def test_set_inside_update():
+    # only the SET line is ignored, as with the regex engine; the UPDATE keeps its WHERE
+    assert convert(['update t\n', 'set a = 1\n', 'where id = 2;\n']) == \
+        'update t\n\t\t--// set a = 1\nwhere id = 2;\n'
+
+
+def test_set_statement():
+    assert convert(['set search_path to x;\n', 'select 1;\n']) == '\t\t--// set search_path to x;\nselect 1;\n'